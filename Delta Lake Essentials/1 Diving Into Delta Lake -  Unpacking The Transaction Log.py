@@ -325,6 +325,33 @@ stream_query_3 = generate_and_append_data_stream_fixed(table_format = "delta", t
 
 # COMMAND ----------
 
+# MAGIC %md **Watch the commits of both streams arrive without re-listing `_delta_log`.**
+
+# COMMAND ----------
+
+# MAGIC %run ./Includes/Delta-Log-Tailer
+
+# COMMAND ----------
+
+tailer = DeltaLogTailer(delta_path)
+tailer.follow(lambda c: print("Version %d: %s, %d files added" % (c.version, c.operation, len(c.adds))), interval = 5, timeout = 30)
+
+# COMMAND ----------
+
+# MAGIC %md **Every 10-second trigger of each stream adds new small files.** `AutoCompactor` bin-packs them once the partitions the streams wrote to hold 50 small files, and commits the rewrite with `dataChange = false`.
+# MAGIC
+# MAGIC It commits with a put-if-absent on `/dbfs`, which Spark's commits to DBFS don't go through, so it must not commit while the streams write. Note the version they are at now; the compactor replays their commits from it once they are stopped.
+
+# COMMAND ----------
+
+# MAGIC %run ./Includes/Delta-Auto-Compaction
+
+# COMMAND ----------
+
+auto_compaction_version = latest_version(delta_path)
+
+# COMMAND ----------
+
 # MAGIC %md Just for sanity check, let's query as a batch
 # MAGIC 
 # MAGIC Note, you can run a read stream, two write streams, and read in batch - concurrently!
@@ -341,6 +368,13 @@ display(spark.sql("select count(*) from loans_delta"))
 
 stop_all_streams()
 
+# With the streams stopped the compactor is the only writer: replay their commits and compact as it would have while following them
+auto_compactor = AutoCompactor(delta_path, min_small_files = 50, version = auto_compaction_version)
+auto_compactor.catch_up()
+print(auto_compactor.status(), auto_compactor.compactions)
+# Raises if a compaction failed; the exceptions are in auto_compactor.errors
+auto_compactor.stop()
+
 # COMMAND ----------
 
 # MAGIC %md ### ![Delta Lake Tiny Logo](https://pages.databricks.com/rs/094-YMS-629/images/delta-lake-tiny-logo.png) Audit Delta Lake Table History
@@ -370,15 +404,29 @@ display(deltaTable.history())
 
 # COMMAND ----------
 
-currentVersion = deltaTable.history(1).select("version").collect()[0][0]
+# MAGIC %run ./Includes/Delta-Table-Stats
 
-v01 = spark.read.format("delta").option("versionAsOf", 1).load(delta_path).count()
-v11 = spark.read.format("delta").option("versionAsOf", 11).load(delta_path).count()
-vno = spark.read.format("delta").option("versionAsOf", currentVersion).load(delta_path).count()
+# COMMAND ----------
+
+# Latest version straight from _delta_log, no history DataFrame or Spark job needed
+currentVersion = latest_version(delta_path)
+
+# Row counts from add.stats.numRecords of each version's files instead of scanning them
+v01 = count_rows(delta_path, 1)
+v11 = count_rows(delta_path, 11)
+vno = count_rows(delta_path, currentVersion)
 print("loans_delta table counts:\n Initial [%s] \n Version 11 [%s] \n Current Version [%s]" % (v01, v11, vno))
 
 # COMMAND ----------
 
+# MAGIC %md **Rows, bytes and files of every version, from a single pass over the log.** Notice the growth from the two streaming writers.
+
+# COMMAND ----------
+
+display(timeline_to_pandas(table_timeline(delta_path)))
+
+# COMMAND ----------
+
 # MAGIC %md ** But, there are a lot of files because of the data versioning.**
 
 # COMMAND ----------
@@ -392,21 +440,22 @@ print("loans_delta table counts:\n Initial [%s] \n Version 11 [%s] \n Current Ve
 # MAGIC 
 # MAGIC If you continuously write data to a Delta table, it will over time accumulate a large number of files, especially if you add data in small batches. This can have an adverse effect on the efficiency of table reads, and it can also affect the performance of your file system. Ideally, a large number of small files should be rewritten into a smaller number of larger files on a regular basis. This is known as compaction.
 # MAGIC 
-# MAGIC You can compact a table by repartitioning it to smaller number of files. In addition, you can specify the option `dataChange` to be false indicates that the operation does not change the data, only rearranges the data layout. This would ensure that other concurrent operations are minimally affected due to this compaction operation.
+# MAGIC You could compact a table by repartitioning it to smaller number of files, but that rewrites every file, including the ones that are already well sized.
+# MAGIC Instead we bin-pack only the small files (taken from the snapshot in the transaction log) into files close to a target size, and commit the rewrite with `dataChange` set to false. This indicates that the operation does not change the data, only rearranges the data layout. This would ensure that other concurrent operations are minimally affected due to this compaction operation.
+# MAGIC
+# MAGIC The compaction only rewrites files that were already committed when it was planned, so it can run while other writers that commit through `write_commit` keep appending: if one commits first, only the bins whose files were removed by that commit are rewritten again. The streams above commit through Spark, which doesn't see `write_commit`'s put-if-absent on `/dbfs`, so they are stopped first.
 
 # COMMAND ----------
 
-numFiles = 4
+# MAGIC %run ./Includes/Delta-Compaction
 
-(spark.read
-   .format("delta")
-   .load(delta_path)
-   .repartition(numFiles)
-   .write
-   .option("dataChange", "false")
-   .format("delta")
-   .mode("overwrite")
-   .save(delta_path))
+# COMMAND ----------
+
+plan = plan_compaction(delta_path, target_file_size = 128 * 1024 * 1024)
+print(plan.summary())
+
+# Appends committed while the bins are rewritten don't touch the compacted files; the commit is simply retried after them
+execute_compaction(plan, max_retries = 5)
 
 # COMMAND ----------
 
@@ -415,9 +464,19 @@ numFiles = 4
 
 # COMMAND ----------
 
+# MAGIC %run ./Includes/Delta-Vacuum
+
+# COMMAND ----------
+
+# Dry run: the files to delete come from the tombstones in the transaction log, without listing the table directory
+print(vacuum_table(delta_path, retention_hours = 0, retention_check = False).summary())
+
+# COMMAND ----------
+
 # This is an anti-pattern
-spark.sql("SET spark.databricks.delta.retentionDurationCheck.enabled = false")
-deltaTable.vacuum(retentionHours = 0)
+report = vacuum_table(delta_path, retention_hours = 0, retention_check = False, dry_run = False,
+                      include_orphans = True, max_workers = 16)
+print(report.summary())
 
 # COMMAND ----------
 
@@ -385,12 +385,16 @@ stop_all_streams()
 
 # COMMAND ----------
 
+# MAGIC %run ./Includes/Delta-Table-Stats
+
+# COMMAND ----------
+
 from delta.tables import *
 delta_path = "/sais_eu_19_demo/loans_delta"
 deltaTable = DeltaTable.forPath(spark, delta_path)
 
-# remember the last commit before schema change
-c_before = deltaTable.history(1).select("version").collect()[0][0]
+# remember the last commit before schema change (read from _delta_log, no Spark job needed)
+c_before = latest_version(delta_path)
 print(c_before)
 
 # COMMAND ----------
@@ -522,15 +526,43 @@ display(commit_after.select("add").where("add is not null"))
 
 # COMMAND ----------
 
+# MAGIC %md #### The same picture in one call
+# MAGIC
+# MAGIC `diff_versions` reads every commit in the range in parallel and reports the net files, bytes and records added and removed, plus the versions that changed the schema.
+
+# COMMAND ----------
+
+# MAGIC %run ./Includes/Delta-Log-Diff
+
+# COMMAND ----------
+
+diff = diff_versions(delta_path, c_before, c_after)
+print(diff.summary())
+for version, operation in diff.operations:
+  print(version, operation)
+
+# COMMAND ----------
+
+# MAGIC %run ./Includes/Delta-Schema-History
+
+# COMMAND ----------
+
+# Columns added or dropped by each schema change, e.g. the mergeSchema stream above
+for version, added, removed in SchemaHistory(delta_path).schema_changes():
+  print(f"Version {version}: added {added}, removed {removed}")
+
+# COMMAND ----------
+
 # MAGIC %md #### Time Travel - Querying historic versions
 
 # COMMAND ----------
 
-currentVersion = deltaTable.history(1).select("version").collect()[0][0]
+currentVersion = latest_version(delta_path)
 
-v_init = spark.read.format("delta").option("versionAsOf", 1).load(delta_path).count()
-v_change = spark.read.format("delta").option("versionAsOf", c_before).load(delta_path).count()
-v_now = spark.read.format("delta").option("versionAsOf", currentVersion).load(delta_path).count()
+# Row counts from add.stats.numRecords of each version's files instead of scanning them
+v_init = count_rows(delta_path, 1)
+v_change = count_rows(delta_path, c_before)
+v_now = count_rows(delta_path, currentVersion)
 print("loans_delta table counts:\n Initial [%s]\n At Schema Change [%s]\n Current Version [%s]" % (v_init, v_change, v_now))
 
 # COMMAND ----------
@@ -547,6 +579,28 @@ display(spark.read.format("delta").option("versionAsOf", c_after).load(delta_pat
 
 # COMMAND ----------
 
+# MAGIC %md #### Compacting an evolved table
+# MAGIC
+# MAGIC The files written before the schema change have no `timestamp` and `value` columns. The compaction reads every file on its own and conforms it to the current schema,
+# MAGIC so the older files get nulls for the new columns and the values the `mergeSchema` stream wrote survive the rewrite.
+
+# COMMAND ----------
+
+# MAGIC %run ./Includes/Delta-Compaction
+
+# COMMAND ----------
+
+with_timestamp = spark.read.format("delta").load(delta_path).where("timestamp is not null").count()
+
+plan = plan_compaction(delta_path)
+print(plan.summary())
+execute_compaction(plan)
+
+# The rewrite is committed with dataChange = false, so it must not change a single value
+assert spark.read.format("delta").load(delta_path).where("timestamp is not null").count() == with_timestamp
+
+# COMMAND ----------
+
 # MAGIC %md #Join the community!
 # MAGIC 
 # MAGIC 
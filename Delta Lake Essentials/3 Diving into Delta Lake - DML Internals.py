@@ -65,6 +65,19 @@ spark.sql("SELECT count(*) FROM loans_delta").show()
 
 # COMMAND ----------
 
+# MAGIC %run ./Includes/Delta-Local-Query
+
+# COMMAND ----------
+
+# The same count without a Spark job, resolved from _delta_log in this process.
+# It is answered from numRecords in the file stats; no Parquet file is opened.
+
+loansLocal = LocalDeltaTable(deltaPath)
+print(loansLocal.explain_aggregate([("*", "count")]))
+loansLocal.count()
+
+# COMMAND ----------
+
 spark.sql("SELECT * FROM loans_delta LIMIT 5").show()
 
 # COMMAND ----------
@@ -112,12 +125,41 @@ display(j0.select("metadata").where("metadata is not null"))
 
 # COMMAND ----------
 
+# MAGIC %md The same commit can be read with plain Python, without starting a Spark job for every log file.
+
+# COMMAND ----------
+
+# MAGIC %run ./Includes/Delta-Log-Reader
+
+# COMMAND ----------
+
+c0 = read_commit(deltaPath, 0)
+print(f"Version {c0.version}: {c0.operation} {c0.commit_info.operation_metrics}")
+for a in c0.adds:
+  print(a.path, a.size, a.num_records)
+
+# COMMAND ----------
+
 jsonStr = j0.select("metadata.schemaString").where("metadata is not null").collect()[0][0]
 df = spark.read.json(sc.parallelize([jsonStr]))
 display(df)
 
 # COMMAND ----------
 
+# MAGIC %md The schema string can also be parsed straight into a `StructType` without a second Spark job. `SchemaHistory` keeps one parsed schema per version range.
+
+# COMMAND ----------
+
+# MAGIC %run ./Includes/Delta-Schema-History
+
+# COMMAND ----------
+
+schemaHistory = SchemaHistory(deltaPath)
+print(schemaHistory.schema_at(0).simpleString())
+print(f"Schema changed at versions: {schemaHistory.changed_versions()}")
+
+# COMMAND ----------
+
 # MAGIC %md ## Review Loans by State
 
 # COMMAND ----------
@@ -127,6 +169,15 @@ display(df)
 
 # COMMAND ----------
 
+# The same aggregation, locally. Comparing two columns needs a pyarrow.compute expression rather than a filter tuple.
+
+byState = loansLocal.aggregate([("funded_amnt", "sum")], group_by = ["addr_state"],
+                               where = pc.field("funded_amnt") != pc.field("paid_amnt")).to_pandas()
+byState["funded_amnt"] = byState.pop("funded_amnt_sum") / 1000000
+display(byState.sort_values("addr_state"))
+
+# COMMAND ----------
+
 # MAGIC %md ## ![Delta Lake Tiny Logo](https://pages.databricks.com/rs/094-YMS-629/images/delta-lake-tiny-logo.png) Updating data 
 # MAGIC 
 # MAGIC You can update the data that matches a predicate from a Delta Lake table. Let's say we want to update all the fully paid loans for `WA` state.
@@ -138,6 +189,19 @@ display(df)
 
 # COMMAND ----------
 
+# loans_delta is not partitioned, so only a file whose addr_state min and max are both WA is answered from its stats
+# (numRecords, nullCount, minValues/maxValues). Files mixing states are scanned and files without WA are skipped;
+# explain_aggregate prints how the files split. The comparison of two columns can't be decided from stats, so with it
+# every file that may hold WA rows is scanned.
+
+waAggregates = [("*", "count"), ("paid_amnt", "count"), ("funded_amnt", "min"), ("funded_amnt", "max")]
+print(loansLocal.explain_aggregate(waAggregates, filters = [("addr_state", "=", "WA")]))
+display(loansLocal.aggregate(waAggregates, filters = [("addr_state", "=", "WA")]).to_pandas())
+
+loansLocal.count([("addr_state", "=", "WA")], where = pc.field("funded_amnt") != pc.field("paid_amnt"))
+
+# COMMAND ----------
+
 from delta.tables import *
 from pyspark.sql.functions import *
 
@@ -341,6 +341,20 @@ display(spark.read.format("json").load(deltaLogPath + "/00000000000000000000.crc
 
 # COMMAND ----------
 
+# MAGIC %run ./Includes/Delta-Table-Stats
+
+# COMMAND ----------
+
+# The same numbers without a Spark job. If a version has no .crc they are derived from the snapshot instead.
+
+stats = table_stats(deltaPath, 0)
+print(f"Source: {stats.source}, files: {stats.num_files}, bytes: {stats.total_bytes}")
+for start, files, size in zip(stats.histogram.sorted_bin_boundaries, stats.histogram.file_counts, stats.histogram.total_bytes):
+  if files:
+    print(f"  >= {start:>12} bytes: {files} files, {size} bytes")
+
+# COMMAND ----------
+
 # History schema details: https://docs.delta.io/latest/delta-utility.html
 
 # Peek inside the transaction log.
@@ -359,9 +373,14 @@ retailSalesData2.count()
 
 # COMMAND ----------
 
+# MAGIC %run ./Includes/Delta-Optimized-Write
+
+# COMMAND ----------
+
 # Add to the Delta table by appending retailSalesData2.
+# optimized_write sizes the files of the append from the rows per file of the existing table, instead of writing one file per task.
 
-retailSalesData2.write.mode("append").format("delta").save(deltaPath)
+optimized_write(retailSalesData2, deltaPath, target_file_size = 1024 * 1024)
 
 # COMMAND ----------
 
@@ -415,6 +434,35 @@ spark.sql(f"""
 
 # COMMAND ----------
 
+# MAGIC %run ./Includes/Delta-Data-Skipping
+
+# COMMAND ----------
+
+# The query above scans every file to find one row. The min/max stats in the log tell us which files can hold the invoice at all.
+
+skippingIndex = build_skipping_index(deltaPath)
+invoiceFilter = [("InvoiceNo", "=", oneRandomInvoice)]
+print(skippingIndex.skipping_summary(invoiceFilter))
+
+(spark.read.format("parquet").load(skippingIndex.candidate_uris(invoiceFilter))
+      .where(col("InvoiceNo") == oneRandomInvoice)
+      .selectExpr("SUBSTRING(input_file_name(), -67, 67) AS FileName", "*")
+      .show(truncate = False))
+
+# COMMAND ----------
+
+# MAGIC %run ./Includes/Delta-Key-Locator
+
+# COMMAND ----------
+
+# Read the InvoiceNo column of every file once; from then on, finding the files of an invoice is a dictionary lookup.
+
+invoiceLocator = KeyLocator(deltaPath, "InvoiceNo")
+print(invoiceLocator)
+invoiceLocator.locate(oneRandomInvoice)
+
+# COMMAND ----------
+
 # Add 1 line item to the table.
 
 spark.sql(f"""
@@ -471,6 +519,14 @@ spark.sql(f"""
 
 # COMMAND ----------
 
+# The locator reads only the files added by the INSERT and the UPDATE, and can answer for each version since it was built.
+
+invoiceLocator.update()
+for version in range(invoiceLocator.base_version, invoiceLocator.version + 1):
+  print(version, invoiceLocator.locate(oneRandomInvoice, version))
+
+# COMMAND ----------
+
 # MAGIC %sql
 # MAGIC /* Notice that version 3 "operationParameters" includes the predicate from the update.*/
 # MAGIC DESCRIBE HISTORY SalesDeltaFormat
@@ -537,16 +593,33 @@ display(spark.read.format("json").load(deltaLogPath + "/00000000000000000004.jso
 
 # COMMAND ----------
 
-# Randomy update several random invoices to force a checkpoint. i.e 10.json => 10.checkpoint.parquet
+# MAGIC %run ./Includes/Delta-Bloom-Filter
+
+# COMMAND ----------
+
+# Back to the invoice lookup: InvoiceNo ranges overlap across files, so min/max stats leave most of them.
+# A bloom filter per file rules out nearly all of the rest. Declaring the index commits a new table version,
+# which is why it comes after the cells above that read specific commit files.
+# Files written from now on by write_data_file (e.g. by execute_compaction) get their filters as they are written.
 
-count = 0
-anInvoice = retailSalesData2.select("InvoiceNo").orderBy(rand()).limit(1).collect()[0][0]
+create_bloom_filter_index(deltaPath, ["InvoiceNo"])
+build_bloom_filters(deltaPath)
+bloomIndex = BloomFilterIndex(deltaPath)
+print(bloomIndex.lookup_summary(invoiceFilter))
 
-while (count <= 7):
-  spark.sql(f"UPDATE SalesDeltaFormat set Quantity = Quantity + 100 WHERE InvoiceNo = {anInvoice}")
-  
-  count = count + 1
-  anInvoice = retailSalesData2.select("InvoiceNo").orderBy(rand()).limit(1).collect()[0][0]
+# COMMAND ----------
+
+# MAGIC %run ./Includes/Delta-Checkpoint-Writer
+
+# COMMAND ----------
+
+# Delta writes a checkpoint every delta.checkpointInterval commits (10 by default), i.e 10.json => 10.checkpoint.parquet.
+# Instead of committing UPDATEs until version 10, write the checkpoint of the current version now,
+# and make this table checkpoint every 5 commits from here on.
+
+checkpointVersion = write_checkpoint(deltaPath)
+spark.sql("ALTER TABLE SalesDeltaFormat SET TBLPROPERTIES ('delta.checkpointInterval' = '5')")
+print(f"Checkpoint written for version {checkpointVersion}")
 
 # COMMAND ----------
 
@@ -555,14 +628,14 @@ display(dbutils.fs.ls(deltaLogPath))
 
 # COMMAND ----------
 
-checkPointDF = spark.read.format("parquet").load(deltaLogPath + "/00000000000000000010.checkpoint.parquet")
+checkPointDF = spark.read.format("parquet").load(deltaLogPath + "/%020d.checkpoint.parquet" % checkpointVersion)
 display(checkPointDF)
 
 # COMMAND ----------
 
 # Organize all the file deletes and additions into one structure.
 
-checkPointFile10 =(
+checkPointFile =(
     checkPointDF.select(col("add.path").alias("FileAdded"),
                         col("add.modificationTime").alias("DateAdded"),
                         col("remove.path").alias("FileDeleted"),
@@ -574,7 +647,7 @@ spark.sql("DROP TABLE IF EXISTS tbl_checkpointfile")
 spark.sql("CREATE TABLE IF NOT EXISTS tbl_checkpointfile (Action string, filename string, ActionDate Long)")
 
 # Create temporay view so that we can use SQL
-checkPointFile10.createOrReplaceTempView("vw_checkpointfile")
+checkPointFile.createOrReplaceTempView("vw_checkpointfile")
 
 # Add operations to tbl_checkpointfile. This will allow us to organize the additions and deletes chronologically.
 
@@ -593,7 +666,7 @@ spark.sql("""
           """)
 
 # Easy to read chronology of files added and deleted.*
-# This only contains those transactions up to and including 10.json.
+# This only contains those transactions up to and including the checkpointed version.
 
 spark.sql("""
            SELECT Action, 
@@ -612,6 +685,31 @@ spark.sql("""
 
 # COMMAND ----------
 
+# MAGIC %md
+# MAGIC The same state can be rebuilt without Spark or a Hive table: load the checkpoint, replay the JSON commits written after it,
+# MAGIC and keep the active files in a dictionary keyed by path.
+
+# COMMAND ----------
+
+# MAGIC %run ./Includes/Delta-Snapshot
+
+# COMMAND ----------
+
+snapshot = load_snapshot(deltaPath)
+print(f"Version {snapshot.version}: {snapshot.num_files} active files, {len(snapshot.tombstones)} tombstones")
+
+for a in sorted(snapshot.files.values(), key=lambda a: a.modification_time):
+  print("Add", a.path, a.modification_time)
+
+# COMMAND ----------
+
+# The checkpoint itself can be read without materializing every nested column: only the projected fields are decoded.
+
+checkPointTable = read_checkpoint_table(deltaPath, checkpointVersion, {"add": ["path", "modificationTime"], "remove": ["path", "deletionTimestamp"]})
+display(checkPointTable.to_pandas())
+
+# COMMAND ----------
+
 # Let's add some data to our table using MERGE (upsert).
 
 # Create a tiny dataframe to use with merge
@@ -683,6 +781,19 @@ file_count(deltaPath)
 
 # COMMAND ----------
 
+# MAGIC %run ./Includes/Delta-Layout-Health
+
+# COMMAND ----------
+
+# file_count also counts the files the overwrite just tombstoned. The layout health only looks at the active files of the snapshot,
+# and flags the table once most of them are far below the target size.
+
+health = layout_health(deltaPath)
+print(health.summary())
+display(spark.createDataFrame([health.to_metrics()]))
+
+# COMMAND ----------
+
 # MAGIC %%time 
 # MAGIC 
 # MAGIC # This simple count will take more time than is needed because spark has to open over 500 files.
@@ -710,6 +821,25 @@ file_count(deltaPath)
 
 # COMMAND ----------
 
+# The active files after OPTIMIZE: compare with the health before it
+
+print(layout_health(deltaPath).summary())
+
+# COMMAND ----------
+
+# MAGIC %run ./Includes/Delta-Compaction
+
+# COMMAND ----------
+
+# OPTIMIZE fixed the file sizes, but every file still holds a random mix of invoices, so a lookup on one InvoiceNo cannot skip any file.
+# Rewrite the table with its rows ordered along a Z-order curve over the columns we filter and group on.
+
+plan = plan_clustering(deltaPath, ["InvoiceNo", "CustomerID"], target_file_size = 1024 * 1024)
+print(plan.summary())
+execute_compaction(plan)
+
+# COMMAND ----------
+
 # MAGIC %%time 
 # MAGIC 
 # MAGIC # Let's run that summary query again and see if the compaction process helps with performance.
@@ -722,18 +852,38 @@ file_count(deltaPath)
 
 # COMMAND ----------
 
+# MAGIC %md
+# MAGIC A single `%%time` run mixes in caching and JIT warmup. The benchmark suite regenerates the table at a fixed size and file count,
+# MAGIC runs the same queries with warmup and repeated trials (as written, compacted and clustered), and records wall time, files read and bytes read as JSON.
+
+# COMMAND ----------
+
+# MAGIC %run ./Includes/Delta-Benchmark
+
+# COMMAND ----------
+
+results = run_suite(basePath + "/benchmark", scales = [(500000, 500)], tables = [BENCHMARK_TABLES[0]], trials = 3,
+                    output_path = basePath + "/benchmark/results")
+display(load_results(basePath + "/benchmark/results"))
+
+# COMMAND ----------
+
 # MAGIC %md
 # MAGIC # Delta Time Travel Queries
 
 # COMMAND ----------
 
+# MAGIC %run ./Includes/Delta-Table-Stats
+
+# COMMAND ----------
+
 # Time Travel Queries
 
-# Determine latest version of the Delta table
-currentVersion = spark.sql("DESCRIBE HISTORY SalesDeltaFormat LIMIT 1").collect()[0][0]
+# Determine latest version of the Delta table straight from _delta_log (see ./Includes/Delta-Log-Reader)
+currentVersion = latest_version(deltaPath)
 
-# Query table as of the current version to attain row count
-currentRowCount = spark.read.format("delta").option("versionAsOf", currentVersion).load(deltaPath).count()
+# Row count as of the current version, summed from the add.stats of its files (no data files are read)
+currentRowCount = count_rows(deltaPath, currentVersion)
 
 print(f"Row Count: {currentRowCount} as of table version {currentVersion}")
 print("")
@@ -746,7 +896,7 @@ print("")
 
 # Determine difference in record count between the current version and the original version of the table.
 
-origRowCount = spark.read.format("delta").option("versionAsOf", 0).load(deltaPath).count()
+origRowCount = count_rows(deltaPath, 0)
 print(f"There are {currentRowCount-origRowCount} more rows in version [{currentVersion}] than version [0] of the table.")
 
 # COMMAND ----------
@@ -758,10 +908,10 @@ print(f"There are {currentRowCount-origRowCount} more rows in version [{currentV
 
 # Current version should have same record count as version 0.
 
-currentVersion = spark.sql("DESCRIBE HISTORY SalesDeltaFormat LIMIT 1").collect()[0][0]
+currentVersion = latest_version(deltaPath)
 
 # Returns "true" if equal
-spark.read.format("delta").option("versionAsOf", currentVersion).load(deltaPath).count() == spark.read.format("delta").option("versionAsOf", 0).load(deltaPath).count()
+count_rows(deltaPath, currentVersion) == count_rows(deltaPath, 0)
 
 # COMMAND ----------
 
@@ -798,6 +948,23 @@ spark.sql("VACUUM SalesDeltaFormat RETAIN 0 HOURS DRY RUN")
 
 # COMMAND ----------
 
+# MAGIC %run ./Includes/Delta-Vacuum
+
+# COMMAND ----------
+
+# The same guardrail, and the same dry run once it is lifted, answered from the tombstones in the log
+
+try:
+  vacuum_table(deltaPath, retention_hours = 0)
+except ValueError as e:
+  print(e)
+
+report = vacuum_table(deltaPath, retention_hours = 0, retention_check = False)
+print(report.summary())
+display(spark.createDataFrame([(c.path, c.size, c.source) for c in report.candidates], "path string, size long, source string"))
+
+# COMMAND ----------
+
 # Disable guardrail
 
 spark.conf.set("spark.databricks.delta.retentionDurationCheck.enabled", False)
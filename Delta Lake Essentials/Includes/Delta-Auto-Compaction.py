@@ -0,0 +1,156 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Auto Compaction
+# MAGIC
+# MAGIC A streaming sink adds at least one small file per partition on every trigger. `AutoCompactor` follows the table's commits with
+# MAGIC `DeltaLogTailer`, keeps the snapshot up to date from them, and remembers which partitions the writers have added files to.
+# MAGIC Once those partitions hold `min_small_files` files smaller than `small_file_size`, it bin-packs them on a background thread
+# MAGIC with the conflict-aware `execute_compaction` of `./Delta-Compaction`. The stream never waits for the compaction:
+# MAGIC its appends cannot conflict with the rewrite, and the compaction commit is retried after them when they win the race.
+# MAGIC At most one compaction runs at a time; commits that arrive meanwhile are folded into the next one.
+# MAGIC A failed compaction is retried with the next commits; its exception is kept in `errors`, shown by `status()`
+# MAGIC and raised by `stop()`, so a compactor that keeps failing does not go unnoticed.
+# MAGIC
+# MAGIC The compaction commits with `write_commit`, whose put-if-absent only excludes writers that commit the same way on the same
+# MAGIC local or FUSE-mounted file system. Spark commits to DBFS through its LogStore, which does not see it, so do not run the
+# MAGIC compactor in the background next to Spark writers there: build it at the version they started from and `catch_up()` once they stop.
+# MAGIC
+# MAGIC Usage:
+# MAGIC
+# MAGIC ```
+# MAGIC %run ./Includes/Delta-Auto-Compaction
+# MAGIC
+# MAGIC auto_compactor = AutoCompactor(delta_path, min_small_files=50)
+# MAGIC auto_compactor.start(interval=10)
+# MAGIC ...
+# MAGIC auto_compactor.status()        # e.g. 'version 42, 3 compactions, 0 errors'
+# MAGIC auto_compactor.stop()          # raises the last error, if any compaction failed
+# MAGIC auto_compactor.compactions     # versions committed by the compactor
+# MAGIC
+# MAGIC # After Spark writers on DBFS have stopped
+# MAGIC auto_compactor = AutoCompactor(delta_path, min_small_files=50, version=streams_start_version)
+# MAGIC auto_compactor.catch_up()
+# MAGIC auto_compactor.stop()
+# MAGIC ```
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Compaction
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Log-Tailer
+
+# COMMAND ----------
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class AutoCompactor:
+
+  # small_file_size defaults to 3/4 of the target, like plan_compaction.
+  # The commits after `version` (the latest when None) are the ones followed.
+  def __init__(self, table_path, min_small_files=50, target_file_size=DEFAULT_TARGET_FILE_SIZE, small_file_size=None, max_retries=5,
+               version=None):
+    self.table_path = table_path
+    self.min_small_files = min_small_files
+    self.target_file_size = target_file_size
+    self.small_file_size = target_file_size * 3 // 4 if small_file_size is None else small_file_size
+    self.max_retries = max_retries
+    self.snapshot = load_snapshot(table_path, version, with_stats=False)
+    check_writable(self.snapshot)
+    self.tailer = DeltaLogTailer(table_path, start_version=self.snapshot.version + 1)
+    self.compactions = []   # versions committed by this compactor
+    self.errors = []        # exceptions of failed compactions and commit handling; failed partitions are tried again later
+    self._pending = set()   # partition keys that received files since they were last compacted
+    self._lock = threading.Lock()
+    self._executor = ThreadPoolExecutor(max_workers=1)
+    self._running = None
+
+  def __repr__(self):
+    return "AutoCompactor(%s, version=%d, compactions=%d, errors=%d)" % (self.table_path, self.snapshot.version,
+                                                                         len(self.compactions), len(self.errors))
+
+  @property
+  def last_error(self):
+    return self.errors[-1] if self.errors else None
+
+  def status(self):
+    running = self._running is not None and not self._running.done()
+    status = "version %d, %d compactions, %d errors%s" % (self.snapshot.version, len(self.compactions), len(self.errors),
+                                                         ", compacting" if running else "")
+    if self.last_error is not None:
+      status += "; last error: %r" % self.last_error
+    return status
+
+  # Called with every new commit of the table, in order
+  def on_commit(self, commit):
+    self.snapshot.apply_commit(commit)
+    columns = self.snapshot.partition_columns
+    with self._lock:
+      self._pending.update(_partition_key(columns, a.partition_values) for a in commit.adds if a.data_change)
+    self.maybe_compact()
+
+  # Start a background compaction of the pending partitions if they hold enough small files and none is running.
+  # Returns the future of the compaction, or None.
+  def maybe_compact(self):
+    with self._lock:
+      if self._running is not None and not self._running.done():
+        return None
+      columns = self.snapshot.partition_columns
+      small_files = [a for a in self.snapshot.files.values()
+                     if a.size < self.small_file_size and _partition_key(columns, a.partition_values) in self._pending]
+      if len(small_files) < self.min_small_files:
+        return None
+      plan = CompactionPlan(table_path=self.table_path,
+                            read_version=self.snapshot.version,
+                            partition_columns=list(columns),
+                            target_file_size=self.target_file_size,
+                            min_file_size=self.small_file_size,
+                            bins=_pack(small_files, columns, self.target_file_size),
+                            table_files=self.snapshot.num_files,
+                            metadata=self.snapshot.metadata)
+      partitions, self._pending = self._pending, set()
+      self._running = self._executor.submit(self._compact, plan, partitions)
+      return self._running
+
+  def _compact(self, plan, partitions):
+    try:
+      version = execute_compaction(plan, max_retries=self.max_retries)
+    except Exception as e:
+      with self._lock:
+        self.errors.append(e)
+        self._pending |= partitions
+      return None
+    if version is not None:
+      self.compactions.append(version)
+    return version
+
+  # on_commit for the tailer thread: an exception there would end the thread without a trace
+  def _on_commit_in_background(self, commit):
+    try:
+      self.on_commit(commit)
+    except Exception as e:
+      with self._lock:
+        self.errors.append(e)
+
+  # Apply the commits written since the last one seen on the calling thread and wait for the compactions they start
+  def catch_up(self):
+    # The second pass applies the commit of the first compaction, which starts one for the partitions folded in meanwhile
+    for _ in range(2):
+      for commit in self.tailer.poll():
+        self.on_commit(commit)
+      if self._running is not None:
+        self._running.result()
+
+  # Follow the table on a background thread, checking for new commits every `interval` seconds
+  def start(self, interval=10.0):
+    return self.tailer.follow_in_background(self._on_commit_in_background, interval)
+
+  # Stop following the table and wait for a running compaction to finish.
+  # Raises the last error unless raise_errors is False; all of them stay in self.errors.
+  def stop(self, raise_errors=True):
+    self.tailer.stop()
+    self._executor.shutdown(wait=True)
+    if raise_errors and self.last_error is not None:
+      raise RuntimeError("%d auto compactions of %s failed" % (len(self.errors), self.table_path)) from self.last_error
@@ -0,0 +1,278 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Benchmark
+# MAGIC
+# MAGIC A repeatable version of the `%%time` cells of the deep-dive notebook: "small files" against "compacted", measured the same way every time.
+# MAGIC
+# MAGIC * `generate_retail_table` / `generate_loans_table` write the retail and loans tables at any number of rows and files.
+# MAGIC   Every column is a hash of the row id and the seed, so the same arguments always produce the same rows.
+# MAGIC * Each query of `RETAIL_QUERIES` / `LOANS_QUERIES` is run `warmup` times without measuring, then `trials` times with
+# MAGIC   `spark.catalog.clearCache()` before each trial. Every trial records the wall time and, from the SQL metrics of the scans
+# MAGIC   of the executed plan, the number of files and bytes read.
+# MAGIC * `run_suite` goes through every table, scale and layout (as written, then each layout step applied in turn to the same table)
+# MAGIC   and writes one JSON document per run, tagged with the Spark version and the table's layout health,
+# MAGIC   so runs before and after a layout or engine change can be compared with `load_results`.
+# MAGIC
+# MAGIC Usage:
+# MAGIC
+# MAGIC ```
+# MAGIC %run ./Includes/Delta-Benchmark
+# MAGIC
+# MAGIC results = run_suite("/tmp/delta-benchmark", scales=[(1000000, 500)], trials=5,
+# MAGIC                     output_path="/dbfs/tmp/delta-benchmark/results")
+# MAGIC display(load_results("/dbfs/tmp/delta-benchmark/results"))
+# MAGIC ```
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Layout-Health
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Compaction
+
+# COMMAND ----------
+
+import builtins
+import glob
+import json
+import os
+import statistics
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+import pandas as pd
+from pyspark.sql import functions as F
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Tables
+
+# COMMAND ----------
+
+RETAIL_COUNTRIES = ["United Kingdom", "France", "Germany", "EIRE", "Spain", "Netherlands", "Belgium", "Switzerland", "Portugal", "Australia"]
+LOAN_STATES = ["CA", "TX", "NY", "WA"]
+
+# Deterministic integer in [0, modulo) for every row, independent of the partitioning
+def _hashed(seed, salt, modulo):
+  return F.pmod(F.xxhash64(F.col("id"), F.lit(seed), F.lit(salt)), F.lit(modulo))
+
+def _pick(values, seed, salt):
+  return F.element_at(F.array(*[F.lit(v) for v in values]), (_hashed(seed, salt, len(values)) + 1).cast("int"))
+
+def _write_benchmark_table(df, table_path, num_files):
+  (df.repartition(num_files)
+     .write
+     .format("delta")
+     .mode("overwrite")
+     .option("overwriteSchema", True)
+     .save(table_path))
+
+# The retail table of the deep-dive notebook (same schema), with about 20 lines per invoice and 4000 customers per million rows
+def generate_retail_table(table_path, num_rows, num_files, seed=42):
+  df = (spark.range(num_rows)
+        .select((F.lit(536365) + F.col("id") / 20).cast("int").alias("InvoiceNo"),
+                (F.lit(20000) + _hashed(seed, 1, 4000)).cast("string").alias("StockCode"),
+                F.concat(F.lit("ITEM "), (F.lit(20000) + _hashed(seed, 1, 4000)).cast("string")).alias("Description"),
+                (_hashed(seed, 2, 24) + 1).cast("int").alias("Quantity"),
+                F.date_format(F.timestamp_seconds(F.lit(1291191960) + F.col("id") * 30), "MM/dd/yyyy HH:mm").alias("InvoiceDate"),
+                (_hashed(seed, 3, 2000) / 100.0).alias("UnitPrice"),
+                (F.lit(12346) + _hashed(seed, 4, builtins.max(1, num_rows // 250))).cast("int").alias("CustomerID"),
+                _pick(RETAIL_COUNTRIES, seed, 5).alias("Country")))
+  _write_benchmark_table(df, table_path, num_files)
+
+# The loans table of the transaction log notebook
+def generate_loans_table(table_path, num_rows, num_files, seed=42):
+  df = (spark.range(num_rows)
+        .select((F.lit(10000) + F.col("id")).alias("loan_id"),
+                (F.lit(5000) + _hashed(seed, 1, 5000)).cast("integer").alias("funded_amnt"),
+                _pick(LOAN_STATES, seed, 2).alias("addr_state"),
+                (_hashed(seed, 3, 200000) / 100.0).alias("paid_off"))
+        .select("loan_id", "funded_amnt", (F.col("funded_amnt") - F.col("paid_off")).alias("paid_amnt"), "addr_state"))
+  _write_benchmark_table(df, table_path, num_files)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Queries
+# MAGIC
+# MAGIC `{table}` is replaced by ``delta.`<path>` ``; the lookups use a key that exists at every scale.
+
+# COMMAND ----------
+
+RETAIL_QUERIES = {
+  "customer_countries": "SELECT CustomerID, count(Country) AS num_countries FROM {table} GROUP BY CustomerID",
+  "invoice_lookup": "SELECT * FROM {table} WHERE InvoiceNo = 536370",
+  "count": "SELECT count(*) FROM {table}",
+}
+
+LOANS_QUERIES = {
+  "state_totals": "SELECT addr_state, sum(funded_amnt), sum(paid_amnt) FROM {table} GROUP BY addr_state",
+  "loan_lookup": "SELECT * FROM {table} WHERE loan_id = 10100",
+  "count": "SELECT count(*) FROM {table}",
+}
+
+@dataclass
+class BenchmarkTable:
+  name: str
+  generate: object                # generate(table_path, num_rows, num_files, seed)
+  queries: Dict[str, str]
+  cluster_by: List[str]           # columns of the "clustered" layout
+
+BENCHMARK_TABLES = [
+  BenchmarkTable("retail", generate_retail_table, RETAIL_QUERIES, ["InvoiceNo", "CustomerID"]),
+  BenchmarkTable("loans", generate_loans_table, LOANS_QUERIES, ["loan_id", "addr_state"]),
+]
+
+# Layout steps, applied in this order to the same table after it was measured as written
+def _compact_layout(table, table_path, target_file_size):
+  execute_compaction(plan_compaction(table_path, target_file_size))
+
+def _cluster_layout(table, table_path, target_file_size):
+  execute_compaction(plan_clustering(table_path, table.cluster_by, target_file_size))
+
+BENCHMARK_LAYOUTS = {
+  "compacted": _compact_layout,
+  "clustered": _cluster_layout,
+}
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Measuring
+
+# COMMAND ----------
+
+# Physical plan nodes of an executed query, looking through adaptive execution and query stages
+def _plan_nodes(plan):
+  nodes, stack = [], [plan]
+  while stack:
+    node = stack.pop()
+    nodes.append(node)
+    name = node.nodeName()
+    if name == "AdaptiveSparkPlan":
+      stack.append(node.executedPlan())
+    elif name.endswith("QueryStage"):
+      stack.append(node.plan())
+    elif name == "ReusedExchange":
+      stack.append(node.child())
+    else:
+      children = node.children()
+      stack.extend(children.apply(i) for i in range(children.size()))
+  return nodes
+
+def _metric(node, name):
+  metric = node.metrics().get(name)
+  return metric.get().value() if metric.isDefined() else None
+
+# Files and bytes read by the file scans of a query that has been executed; None when the engine exposes no scan metrics
+def scan_metrics(df):
+  files, size, found = 0, 0, False
+  for node in _plan_nodes(df._jdf.queryExecution().executedPlan()):
+    num_files = _metric(node, "numFiles")
+    if num_files is None:
+      continue
+    found = True
+    files += num_files
+    size += _metric(node, "filesSize") or 0
+  return (files, size) if found else (None, None)
+
+@dataclass
+class QueryResult:
+  table: str
+  num_rows: int
+  num_files: int               # files the table was generated with
+  layout: str
+  query: str
+  sql: str
+  trials: List[float]          # wall seconds of each measured trial
+  files_read: Optional[int]
+  bytes_read: Optional[int]
+  result_rows: int
+  layout_health: Dict[str, object] = field(default_factory=dict)
+
+  @property
+  def median_seconds(self):
+    return statistics.median(self.trials)
+
+# Run one query `warmup` times unmeasured, then `trials` times measured, each time with an empty cache
+def run_query(sql, warmup=1, trials=5):
+  for _ in range(warmup):
+    spark.sql(sql).collect()
+  timings, files_read, bytes_read, rows = [], None, None, 0
+  for _ in range(trials):
+    spark.catalog.clearCache()
+    df = spark.sql(sql)
+    start = time.perf_counter()
+    rows = len(df.collect())
+    timings.append(time.perf_counter() - start)
+    files_read, bytes_read = scan_metrics(df)
+  return timings, files_read, bytes_read, rows
+
+def _benchmark_layout(table, table_path, num_rows, num_files, layout, warmup, trials):
+  health = layout_health(table_path).to_metrics(prefix="layout")
+  results = []
+  for name, template in table.queries.items():
+    sql = template.format(table="delta.`%s`" % table_path)
+    timings, files_read, bytes_read, rows = run_query(sql, warmup, trials)
+    results.append(QueryResult(table.name, num_rows, num_files, layout, name, sql, timings, files_read, bytes_read, rows, health))
+    print("%-7s %10d rows %5d files  %-10s %-20s median %.3f s, %s files read"
+          % (table.name, num_rows, num_files, layout, name, statistics.median(timings), files_read))
+  return results
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Suite and results
+
+# COMMAND ----------
+
+# Every table of `tables` at every (num_rows, num_files) of `scales`, measured as written and after each step of `layouts`.
+# The tables are written under base_path. The results are returned and, when output_path is given, saved there as JSON.
+def run_suite(base_path, scales=((100000, 500),), tables=None, layouts=None, warmup=1, trials=5, seed=42,
+              target_file_size=DEFAULT_TARGET_FILE_SIZE, output_path=None):
+  tables = BENCHMARK_TABLES if tables is None else tables
+  layouts = BENCHMARK_LAYOUTS if layouts is None else layouts
+  started = time.time()
+  results = []
+  for table in tables:
+    for num_rows, num_files in scales:
+      table_path = "%s/%s_%d_%d" % (base_path.rstrip("/"), table.name, num_rows, num_files)
+      table.generate(table_path, num_rows, num_files, seed)
+      results += _benchmark_layout(table, table_path, num_rows, num_files, "as_written", warmup, trials)
+      for layout, apply_layout in layouts.items():
+        apply_layout(table, table_path, target_file_size)
+        results += _benchmark_layout(table, table_path, num_rows, num_files, layout, warmup, trials)
+  if output_path is not None:
+    save_results(results, output_path, started, {"warmup": warmup, "trials": trials, "seed": seed, "targetFileSize": target_file_size})
+  return results
+
+# Write one JSON document for this run into the directory `output_path`; returns its path
+def save_results(results, output_path, started=None, settings=None):
+  started = started or time.time()
+  run = {"runId": str(uuid.uuid4()),
+         "started": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(started)),
+         "sparkVersion": spark.version,
+         "settings": settings or {},
+         "results": [dict(asdict(r), median_seconds=r.median_seconds) for r in results]}
+  os.makedirs(to_local_path(output_path), exist_ok=True)
+  path = os.path.join(to_local_path(output_path), "benchmark-%s-%s.json" % (time.strftime("%Y%m%d-%H%M%S", time.gmtime(started)), run["runId"][:8]))
+  with open(path, "w", encoding="utf-8") as f:
+    json.dump(run, f, indent=2)
+  return path
+
+# All results saved in `output_path` as one pandas DataFrame, one row per run and query, oldest run first
+def load_results(output_path):
+  rows = []
+  for path in sorted(glob.glob(os.path.join(to_local_path(output_path), "benchmark-*.json"))):
+    with open(path, "r", encoding="utf-8") as f:
+      run = json.load(f)
+    for result in run["results"]:
+      row = {k: v for k, v in result.items() if k not in ("trials", "layout_health", "sql")}
+      row.update(runId=run["runId"], started=run["started"], sparkVersion=run["sparkVersion"],
+                 layout_files=result["layout_health"].get("layout.num_files"))
+      rows.append(row)
+  return pd.DataFrame(rows)
@@ -0,0 +1,245 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Bloom Filter Index
+# MAGIC
+# MAGIC Min/max ranges only help when a file holds a narrow range of keys. On files that are not clustered, every file's `InvoiceNo`
+# MAGIC range spans almost the whole column, so an equality lookup can skip nothing. A Bloom filter per file and column answers
+# MAGIC "can this key be in this file?" with no false negatives and, by default, 1% false positives.
+# MAGIC
+# MAGIC * `create_bloom_filter_index` records the indexed columns in the table properties (`bloomFilter.columns`, `bloomFilter.fpp`).
+# MAGIC * From then on every file written by `write_data_file` with the table's metadata (compaction and clustering runs do so) gets a sidecar
+# MAGIC   `_delta_index/bloom/<file path>.bloom` holding one filter per indexed column. Files written by Spark are indexed
+# MAGIC   by `build_bloom_filters`, which only reads the indexed columns of the active files that have no sidecar yet.
+# MAGIC * `BloomFilterIndex.candidate_files` first prunes with the min/max index of `./Delta-Data-Skipping`, then drops
+# MAGIC   the remaining files whose filters rule out every key of an `=` / `in` term. A file without a sidecar is always kept.
+# MAGIC
+# MAGIC Usage:
+# MAGIC
+# MAGIC ```
+# MAGIC %run ./Includes/Delta-Bloom-Filter
+# MAGIC
+# MAGIC create_bloom_filter_index(deltaPath, ["InvoiceNo"])
+# MAGIC build_bloom_filters(deltaPath)
+# MAGIC BloomFilterIndex(deltaPath).candidate_files([("InvoiceNo", "=", 536365)])
+# MAGIC ```
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Data-Skipping
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Log-Writer
+
+# COMMAND ----------
+
+import base64
+import builtins
+import hashlib
+import json
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+import numpy as np
+import pyarrow.parquet as pq
+
+BLOOM_FILTER_COLUMNS_PROPERTY = "bloomFilter.columns"
+BLOOM_FILTER_FPP_PROPERTY = "bloomFilter.fpp"
+DEFAULT_BLOOM_FILTER_FPP = 0.01
+BLOOM_INDEX_DIR = "_delta_index/bloom"
+
+class BloomFilter:
+
+  def __init__(self, num_bits, num_hashes, bits=None):
+    self.num_bits = num_bits
+    self.num_hashes = num_hashes
+    self.bits = np.zeros((num_bits + 7) // 8, dtype=np.uint8) if bits is None else bits
+
+  # Sized for `num_values` distinct values at false-positive probability `fpp`
+  @classmethod
+  def for_values(cls, num_values, fpp=DEFAULT_BLOOM_FILTER_FPP):
+    num_values = builtins.max(1, num_values)
+    num_bits = builtins.max(64, int(math.ceil(-num_values * math.log(fpp) / math.log(2) ** 2)))
+    return cls(num_bits, builtins.max(1, int(builtins.round(num_bits / num_values * math.log(2)))))
+
+  # Bit positions of a key: h1 + i * h2 (Kirsch-Mitzenmacher) from one 128-bit digest
+  def _positions(self, key):
+    digest = hashlib.blake2b(key, digest_size=16).digest()
+    h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+  def add(self, key):
+    for p in self._positions(key):
+      self.bits[p >> 3] |= 1 << (p & 7)
+
+  def might_contain(self, key):
+    return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+  def to_json(self):
+    return {"numBits": self.num_bits, "numHashes": self.num_hashes, "bits": base64.b64encode(self.bits.tobytes()).decode("ascii")}
+
+  @classmethod
+  def from_json(cls, d):
+    return cls(d["numBits"], d["numHashes"], np.frombuffer(base64.b64decode(d["bits"]), dtype=np.uint8).copy())
+
+# Bytes hashed for a value of a column of `delta_type`. Values are normalized the way data skipping compares them,
+# so 536365, "536365" and numpy.int32(536365) are the same key of an integer column.
+def _bloom_key(delta_type, value):
+  return repr(_typed_value(delta_type, value)).encode("utf-8")
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Building the sidecars
+
+# COMMAND ----------
+
+def bloom_file_path(table_path, add_path):
+  return os.path.join(to_local_path(table_path), BLOOM_INDEX_DIR, unquote(add_path) + ".bloom")
+
+# {column: delta type} of the indexed columns and the fpp, from the table properties in `metadata`
+def bloom_filter_settings(metadata):
+  configuration = metadata.configuration or {}
+  names = [c.strip() for c in configuration.get(BLOOM_FILTER_COLUMNS_PROPERTY, "").split(",") if c.strip()]
+  types = {f["name"]: f["type"] for f in metadata.schema["fields"]}
+  return {c: types[c] for c in names if c in types}, float(configuration.get(BLOOM_FILTER_FPP_PROPERTY, DEFAULT_BLOOM_FILTER_FPP))
+
+# Index `columns` of the table: commits the table properties that make every later write_data_file build the filters
+def create_bloom_filter_index(table_path, columns, fpp=DEFAULT_BLOOM_FILTER_FPP):
+  snapshot = load_snapshot(table_path, with_stats=False)
+  known = {f["name"]: f["type"] for f in snapshot.metadata.schema["fields"]}
+  for c in columns:
+    if known.get(c) not in _SKIPPING_TYPES:
+      raise ValueError("%s is not a column of a primitive type of %s" % (c, table_path))
+  existing, _ = bloom_filter_settings(snapshot.metadata)
+  names = list(existing) + [c for c in columns if c not in existing]
+  return commit_table_properties(snapshot, {BLOOM_FILTER_COLUMNS_PROPERTY: ",".join(names), BLOOM_FILTER_FPP_PROPERTY: str(fpp)},
+                                 operation="CREATE BLOOMFILTER INDEX")
+
+# Write the sidecar of one data file from an Arrow table holding (at least) its indexed columns
+def write_bloom_filters(table_path, add, table, columns, fpp=DEFAULT_BLOOM_FILTER_FPP):
+  filters = {}
+  for name, delta_type in columns.items():
+    if name not in table.column_names:
+      continue
+    values = [v for v in table.column(name).unique().to_pylist() if v is not None]
+    bloom = BloomFilter.for_values(len(values), fpp)
+    for value in values:
+      bloom.add(_bloom_key(delta_type, value))
+    filters[name] = bloom.to_json()
+  path = bloom_file_path(table_path, add.path)
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(path, "w", encoding="utf-8") as f:
+    json.dump({"path": add.path, "columns": filters}, f, separators=(",", ":"))
+
+# The indexed columns come from the metadata the writer already read the table with (e.g. CompactionPlan.metadata);
+# a write without metadata gets no sidecar, and build_bloom_filters indexes its files later
+def _bloom_write_hook(table_path, add, table, metadata):
+  if metadata is None:
+    return
+  columns, fpp = bloom_filter_settings(metadata)
+  if columns:
+    write_bloom_filters(table_path, add, table, columns, fpp)
+
+# Replaces the hook registered by an earlier run of this notebook
+DATA_FILE_WRITE_HOOKS[:] = [h for h in DATA_FILE_WRITE_HOOKS if h.__name__ != "_bloom_write_hook"] + [_bloom_write_hook]
+
+# Build the missing sidecars of the active files (e.g. files written by Spark), reading only the indexed columns.
+# Returns the number of files indexed.
+def build_bloom_filters(table_path, version=None, max_workers=8, snapshot=None):
+  if snapshot is None:
+    snapshot = load_snapshot(table_path, version, with_stats=False)
+  columns, fpp = bloom_filter_settings(snapshot.metadata)
+  if not columns:
+    raise ValueError("%s has no bloom filter index; call create_bloom_filter_index first" % table_path)
+  missing = [a for a in snapshot.files.values() if not os.path.exists(bloom_file_path(table_path, a.path))]
+
+  def index_file(add):
+    data = pq.read_table(data_file_path(table_path, add.path), columns=[c for c in columns if c not in snapshot.partition_columns])
+    write_bloom_filters(table_path, add, data, columns, fpp)
+
+  with ThreadPoolExecutor(max_workers=max_workers) as pool:
+    list(pool.map(index_file, missing))
+  return len(missing)
+
+# Delete the sidecars whose data file is gone from disk (run after VACUUM). Returns the number deleted.
+def vacuum_bloom_filters(table_path):
+  root = to_local_path(table_path)
+  index_dir = os.path.join(root, BLOOM_INDEX_DIR)
+  deleted = 0
+  for directory, _, names in os.walk(index_dir):
+    for name in names:
+      path = os.path.join(directory, name)
+      # bloom_file_path in reverse: the sidecar mirrors the data file's path under the table root
+      if name.endswith(".bloom") and not os.path.exists(os.path.join(root, os.path.relpath(path, index_dir)[:-len(".bloom")])):
+        os.remove(path)
+        deleted += 1
+  return deleted
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Looking up keys
+
+# COMMAND ----------
+
+class BloomFilterIndex:
+
+  def __init__(self, table_path, version=None):
+    self.table_path = table_path
+    self.skipping_index = build_skipping_index(table_path, version)
+    self.version = self.skipping_index.version
+    self.columns, _ = bloom_filter_settings(load_snapshot(table_path, self.version, with_stats=False).metadata)
+    self._filters = {}   # add.path -> {column: BloomFilter}, or None without a sidecar; data files never change
+    self._lock = threading.Lock()
+
+  def __repr__(self):
+    return "BloomFilterIndex(%s, version=%d, columns=%s)" % (self.table_path, self.version, list(self.columns))
+
+  def _file_filters(self, add):
+    with self._lock:
+      if add.path in self._filters:
+        return self._filters[add.path]
+    try:
+      with open(bloom_file_path(self.table_path, add.path), "r", encoding="utf-8") as f:
+        filters = {c: BloomFilter.from_json(d) for c, d in json.load(f)["columns"].items()}
+    except FileNotFoundError:
+      filters = None
+    with self._lock:
+      self._filters[add.path] = filters
+    return filters
+
+  # False when the file's filters prove that no term of the conjunction on an indexed column can match
+  def _might_match(self, add, conjunction):
+    filters = None
+    for column, op, value in conjunction:
+      if column not in self.columns or op.lower() not in ("=", "==", "in"):
+        continue
+      if filters is None:
+        filters = self._file_filters(add)
+        if filters is None:
+          return True
+      bloom = filters.get(column)
+      if bloom is None:
+        continue
+      values = value if op.lower() == "in" else [value]
+      if not any(bloom.might_contain(_bloom_key(self.columns[column], v)) for v in values):
+        return False
+    return True
+
+  # The AddFiles that may hold rows matching `filters` (same format as DataSkippingIndex.candidate_files)
+  def candidate_files(self, filters):
+    selected = np.zeros(len(self.skipping_index), dtype=bool)
+    for conjunction in _normalize_filters(filters):
+      for i in np.flatnonzero(self.skipping_index.mask([conjunction]) & ~selected):
+        if self._might_match(self.skipping_index.files[i], conjunction):
+          selected[i] = True
+    return [self.skipping_index.files[i] for i in np.flatnonzero(selected)]
+
+  def lookup_summary(self, filters):
+    by_stats = len(self.skipping_index.candidate_files(filters))
+    by_bloom = len(self.candidate_files(filters))
+    return "%d files, %d left by min/max stats, %d left by bloom filters for %s" % (len(self.skipping_index), by_stats, by_bloom, filters)
@@ -0,0 +1,212 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Checkpoint Reader
+# MAGIC
+# MAGIC Every 10 commits Delta writes the full table state into `_delta_log/000...N.checkpoint.parquet` and records it in `_delta_log/_last_checkpoint`.
+# MAGIC A reader only has to load that checkpoint and replay the JSON commits written after it.
+# MAGIC
+# MAGIC These helpers find the newest usable checkpoint (single file or multi-part) and turn its rows back into the typed actions of `./Delta-Log-Reader`.
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Log-Reader
+
+# COMMAND ----------
+
+import builtins
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# 00000000000000000010.checkpoint.parquet, or 00000000000000000010.checkpoint.0000000001.0000000003.parquet for part 1 of 3
+_CHECKPOINT_FILE_RE = re.compile(r"^(\d{20})\.checkpoint(?:\.(\d{10})\.(\d{10}))?\.parquet$")
+
+def checkpoint_file_path(table_path, version, part=None, parts=None):
+  if parts is None:
+    name = "%020d.checkpoint.parquet" % version
+  else:
+    name = "%020d.checkpoint.%010d.%010d.parquet" % (version, part, parts)
+  return os.path.join(delta_log_path(table_path), name)
+
+# {version: number of parts (None for a single-file checkpoint)} for every complete checkpoint in _delta_log.
+# A multi-part checkpoint only counts once all of its parts have been written.
+def list_checkpoints(table_path):
+  single = set()
+  parts_seen = {}
+  with os.scandir(delta_log_path(table_path)) as entries:
+    for entry in entries:
+      m = _CHECKPOINT_FILE_RE.match(entry.name)
+      if m is None:
+        continue
+      version = int(m.group(1))
+      if m.group(2) is None:
+        single.add(version)
+      else:
+        parts_seen.setdefault((version, int(m.group(3))), set()).add(int(m.group(2)))
+  checkpoints = {v: None for v in single}
+  for (version, parts), seen in parts_seen.items():
+    if len(seen) == parts and version not in checkpoints:
+      checkpoints[version] = parts
+  return checkpoints
+
+def list_checkpoint_versions(table_path):
+  return sorted(list_checkpoints(table_path))
+
+# Version of the newest checkpoint at or before `version` (the latest one when version is None), or None if there is none
+def find_checkpoint_version(table_path, version=None):
+  if version is None:
+    last = read_last_checkpoint(table_path)
+    if last is not None and _checkpoint_complete(table_path, last["version"], last.get("parts")):
+      return last["version"]
+  candidates = [v for v in list_checkpoint_versions(table_path) if version is None or v <= version]
+  return candidates[-1] if candidates else None
+
+def _checkpoint_complete(table_path, version, parts):
+  if parts is None:
+    return os.path.exists(checkpoint_file_path(table_path, version))
+  return all(os.path.exists(checkpoint_file_path(table_path, version, part, parts)) for part in range(1, parts + 1))
+
+# All parquet files making up the checkpoint at `version`, in part order
+def checkpoint_files(table_path, version, parts=None):
+  if parts is None:
+    if os.path.exists(checkpoint_file_path(table_path, version)):
+      return [checkpoint_file_path(table_path, version)]
+    parts = list_checkpoints(table_path).get(version)
+    if parts is None:
+      raise FileNotFoundError("No complete checkpoint for version %d in %s" % (version, delta_log_path(table_path)))
+  return [checkpoint_file_path(table_path, version, part, parts) for part in range(1, parts + 1)]
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Projected reads
+# MAGIC
+# MAGIC Checkpoints of tables with millions of files are hundreds of MB, most of it `add.stats` JSON.
+# MAGIC The files are memory-mapped and read one row group at a time, decoding only the requested action columns
+# MAGIC (e.g. `add.path`, `add.modificationTime`, `remove.path`, `remove.deletionTimestamp`).
+# MAGIC Row groups whose footer statistics show that a requested action column is entirely null are skipped without being decoded.
+
+# COMMAND ----------
+
+# Column that is never null for an action of the given type; used to find the rows (and row groups) holding that action
+_ACTION_KEY_COLUMNS = {
+  "add": "path",
+  "remove": "path",
+  "metaData": "id",
+  "protocol": "minReaderVersion",
+  "txn": "appId",
+}
+
+# Fields needed to rebuild a table snapshot. `add.stats` is only needed for row counts and data skipping.
+SNAPSHOT_COLUMNS = {
+  "add": ["path", "size", "partitionValues", "modificationTime", "dataChange", "tags"],
+  "remove": ["path", "deletionTimestamp", "dataChange", "extendedFileMetadata", "partitionValues", "size"],
+  "metaData": None,
+  "protocol": None,
+  "txn": None,
+}
+
+def _projection(schema, columns):
+  projected = []
+  for action, fields in columns.items():
+    idx = schema.get_field_index(action)
+    if idx < 0:
+      continue
+    if fields is None:
+      projected.append(action)
+      continue
+    struct = schema.field(idx).type
+    projected.extend("%s.%s" % (action, f) for f in fields if struct.get_field_index(f) >= 0)
+  return projected
+
+# Indices of the row groups that can contain at least one of the requested actions, based on footer null counts
+def _row_groups_with_actions(metadata, actions):
+  key_paths = {"%s.%s" % (a, _ACTION_KEY_COLUMNS[a]) for a in actions if a in _ACTION_KEY_COLUMNS}
+  selected = []
+  for i in range(metadata.num_row_groups):
+    row_group = metadata.row_group(i)
+    keep = False
+    for j in range(row_group.num_columns):
+      column = row_group.column(j)
+      if column.path_in_schema not in key_paths:
+        continue
+      stats = column.statistics
+      if stats is None or not stats.has_null_count or stats.null_count < row_group.num_rows:
+        keep = True
+        break
+    if keep or not key_paths:
+      selected.append(i)
+  return selected
+
+# Memory-map the checkpoint at `version` and yield one pyarrow Table per useful row group, holding only the projected columns.
+# `columns` maps an action name to the list of its fields to decode, or None for all of them.
+def iter_checkpoint_batches(table_path, version, columns=SNAPSHOT_COLUMNS, parts=None):
+  for file_path in checkpoint_files(table_path, version, parts):
+    yield from _iter_file_batches(file_path, columns)
+
+def _iter_file_batches(file_path, columns):
+  with pa.memory_map(file_path, "r") as source:
+    parquet_file = pq.ParquetFile(source)
+    projected = _projection(parquet_file.schema_arrow, columns)
+    for i in _row_groups_with_actions(parquet_file.metadata, columns):
+      yield parquet_file.read_row_group(i, columns=projected)
+
+# The projected checkpoint as one pyarrow Table, e.g. read_checkpoint_table(deltaPath, 10, {"add": ["path", "modificationTime"]})
+def read_checkpoint_table(table_path, version, columns=SNAPSHOT_COLUMNS, parts=None):
+  batches = list(iter_checkpoint_batches(table_path, version, columns, parts))
+  if not batches:
+    return None
+  return pa.concat_tables(batches)
+
+# COMMAND ----------
+
+# Parquet map columns (add.partitionValues, add.tags, ...) come back from Arrow as lists of (key, value) pairs
+def _map_to_dict(value):
+  if isinstance(value, list):
+    return dict(value)
+  return value
+
+_CHECKPOINT_MAP_FIELDS = {
+  "add": ("partitionValues", "tags"),
+  "remove": ("partitionValues", "tags"),
+  "metaData": ("configuration",),
+}
+
+def _normalize_checkpoint_value(action, value):
+  for map_field in _CHECKPOINT_MAP_FIELDS.get(action, ()):
+    if map_field in value:
+      value[map_field] = _map_to_dict(value[map_field])
+  if action == "metaData" and isinstance(value.get("format"), dict):
+    value["format"]["options"] = _map_to_dict(value["format"].get("options"))
+  return value
+
+# Yield the typed actions stored in the checkpoint written at `version`.
+# Only the rows holding each requested action are converted to Python objects.
+def iter_checkpoint_actions(table_path, version, columns=SNAPSHOT_COLUMNS, parts=None):
+  for batch in iter_checkpoint_batches(table_path, version, columns, parts):
+    yield from _batch_actions(batch, columns)
+
+def _batch_actions(batch, columns):
+  for action in columns:
+    if action not in batch.column_names:
+      continue
+    column = batch.column(action)
+    present = column.filter(pc.is_valid(column))
+    for value in present.to_pylist():
+      yield parse_action({action: _normalize_checkpoint_value(action, value)})
+
+def _file_actions(file_path, columns):
+  return [action for batch in _iter_file_batches(file_path, columns) for action in _batch_actions(batch, columns)]
+
+# All typed actions of the checkpoint at `version`. The parts of a multi-part checkpoint are decoded concurrently
+# (Parquet decoding releases the GIL), and returned in part order.
+def read_checkpoint_actions(table_path, version, columns=SNAPSHOT_COLUMNS, parts=None, max_workers=8):
+  files = checkpoint_files(table_path, version, parts)
+  if len(files) == 1:
+    return _file_actions(files[0], columns)
+  with ThreadPoolExecutor(max_workers=builtins.min(max_workers, len(files))) as pool:
+    return [action for part in pool.map(lambda f: _file_actions(f, columns), files) for action in part]
@@ -0,0 +1,154 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Checkpoint Writer
+# MAGIC
+# MAGIC Delta writes a checkpoint every `delta.checkpointInterval` commits (10 by default). This notebook writes them on demand:
+# MAGIC
+# MAGIC * `write_checkpoint` stores the snapshot of a version as a checkpoint and points `_last_checkpoint` at it.
+# MAGIC   Checkpoints with more than `actions_per_part` actions are split into a multi-part checkpoint
+# MAGIC   (`000...N.checkpoint.0000000001.0000000004.parquet`, ...) whose parts are written in parallel,
+# MAGIC   and which `load_snapshot` reads back in parallel.
+# MAGIC * `set_checkpoint_interval` changes `delta.checkpointInterval` of one table, the same as
+# MAGIC   `ALTER TABLE ... SET TBLPROPERTIES ('delta.checkpointInterval' = '5')`.
+# MAGIC * `maybe_write_checkpoint` writes the checkpoint of a version when the interval says so; call it after your own commits.
+# MAGIC
+# MAGIC Like Delta, tombstones older than `delta.deletedFileRetentionDuration` are left out of the checkpoint.
+# MAGIC
+# MAGIC Usage:
+# MAGIC
+# MAGIC ```
+# MAGIC %run ./Includes/Delta-Checkpoint-Writer
+# MAGIC
+# MAGIC write_checkpoint(delta_path)                            # latest version, now
+# MAGIC write_checkpoint(delta_path, actions_per_part=100000)   # multi-part
+# MAGIC set_checkpoint_interval(delta_path, 50)
+# MAGIC ```
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Vacuum
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Log-Writer
+
+# COMMAND ----------
+
+import builtins
+import json
+import math
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DEFAULT_CHECKPOINT_INTERVAL = 10
+DEFAULT_CHECKPOINT_PART_SIZE = 1000000   # actions per part
+CHECKPOINT_ROW_GROUP_SIZE = 50000        # small enough for readers to skip the row groups without the actions they need
+
+_STRING_MAP = pa.map_(pa.string(), pa.string())
+
+CHECKPOINT_SCHEMA = pa.schema([
+  ("txn", pa.struct([("appId", pa.string()), ("version", pa.int64()), ("lastUpdated", pa.int64())])),
+  ("add", pa.struct([("path", pa.string()), ("partitionValues", _STRING_MAP), ("size", pa.int64()),
+                     ("modificationTime", pa.int64()), ("dataChange", pa.bool_()), ("stats", pa.string()),
+                     ("tags", _STRING_MAP)])),
+  ("remove", pa.struct([("path", pa.string()), ("deletionTimestamp", pa.int64()), ("dataChange", pa.bool_()),
+                        ("extendedFileMetadata", pa.bool_()), ("partitionValues", _STRING_MAP), ("size", pa.int64())])),
+  ("metaData", pa.struct([("id", pa.string()), ("name", pa.string()), ("description", pa.string()),
+                          ("format", pa.struct([("provider", pa.string()), ("options", _STRING_MAP)])),
+                          ("schemaString", pa.string()), ("partitionColumns", pa.list_(pa.string())),
+                          ("configuration", _STRING_MAP), ("createdTime", pa.int64())])),
+  ("protocol", pa.struct([("minReaderVersion", pa.int32()), ("minWriterVersion", pa.int32())])),
+])
+
+# delta.checkpointInterval of the table
+def checkpoint_interval(snapshot):
+  configuration = snapshot.metadata.configuration if snapshot.metadata else {}
+  return int(configuration.get("delta.checkpointInterval", DEFAULT_CHECKPOINT_INTERVAL))
+
+# COMMAND ----------
+
+# Checkpoint rows hold maps as lists of (key, value) pairs
+def _as_map(d):
+  return None if d is None else list(d.items())
+
+# One checkpoint row for `action`: {column: struct value}
+def _checkpoint_row(action):
+  (name, value), = action_to_dict(action).items()
+  if name in ("add", "remove"):
+    value["partitionValues"] = _as_map(value.get("partitionValues"))
+    if name == "add":
+      value["tags"] = _as_map(value.get("tags"))
+  elif name == "metaData":
+    value["configuration"] = _as_map(value.get("configuration"))
+    value["format"]["options"] = _as_map(value["format"].get("options"))
+  return name, value
+
+def _write_checkpoint_part(path, actions):
+  columns = {field.name: [None] * len(actions) for field in CHECKPOINT_SCHEMA}
+  for i, action in enumerate(actions):
+    name, value = _checkpoint_row(action)
+    columns[name][i] = value
+  table = pa.Table.from_pydict(columns, schema=CHECKPOINT_SCHEMA)
+  # Written under a temporary name and renamed, so a part is never visible half-written
+  tmp_path = os.path.join(os.path.dirname(path), ".%s.%s.tmp" % (os.path.basename(path), uuid.uuid4()))
+  pq.write_table(table, tmp_path, row_group_size=CHECKPOINT_ROW_GROUP_SIZE)
+  os.replace(tmp_path, path)
+  return os.path.getsize(path)
+
+# Point _last_checkpoint at `checkpoint` unless it already points at a newer version
+def _update_last_checkpoint(table_path, checkpoint):
+  last = read_last_checkpoint(table_path)
+  if last is not None and last["version"] > checkpoint["version"]:
+    return
+  path = os.path.join(delta_log_path(table_path), LAST_CHECKPOINT_FILE)
+  tmp_path = os.path.join(delta_log_path(table_path), ".%s.%s.tmp" % (LAST_CHECKPOINT_FILE, uuid.uuid4()))
+  with open(tmp_path, "w", encoding="utf-8") as f:
+    f.write(json.dumps(checkpoint, separators=(",", ":")))
+  os.replace(tmp_path, path)
+
+# Write the checkpoint of `version` (the latest when None) and return its version.
+# The actions are split into parts of at most actions_per_part actions, written by max_workers threads.
+def write_checkpoint(table_path, version=None, actions_per_part=DEFAULT_CHECKPOINT_PART_SIZE, max_workers=8, snapshot=None):
+  if snapshot is None:
+    snapshot = load_snapshot(table_path, version)
+  if snapshot.protocol is not None and (snapshot.protocol.min_reader_version >= 3 or snapshot.protocol.min_writer_version >= 7):
+    # Protocol only keeps the versions, so the table features of such a table would be lost
+    raise ValueError("%s uses table features; let Delta write its checkpoints" % table_path)
+  cutoff = int((time.time() - deleted_file_retention_hours(snapshot) * 3600) * 1000)
+  actions = [snapshot.protocol, snapshot.metadata] + list(snapshot.txns.values()) + list(snapshot.files.values())
+  actions += [r for r in snapshot.tombstones.values() if (r.deletion_timestamp or 0) >= cutoff]
+  actions = [a for a in actions if a is not None]
+
+  parts = builtins.max(1, math.ceil(len(actions) / actions_per_part))
+  if parts == 1:
+    sizes = [_write_checkpoint_part(checkpoint_file_path(table_path, snapshot.version), actions)]
+  else:
+    per_part = math.ceil(len(actions) / parts)
+    chunks = [actions[i * per_part:(i + 1) * per_part] for i in range(parts)]
+    paths = [checkpoint_file_path(table_path, snapshot.version, part, parts) for part in range(1, parts + 1)]
+    with ThreadPoolExecutor(max_workers=builtins.min(max_workers, parts)) as pool:
+      sizes = list(pool.map(_write_checkpoint_part, paths, chunks))
+
+  checkpoint = {"version": snapshot.version, "size": len(actions), "sizeInBytes": builtins.sum(sizes), "numOfAddFiles": snapshot.num_files}
+  if parts > 1:
+    checkpoint["parts"] = parts
+  _update_last_checkpoint(table_path, checkpoint)
+  return snapshot.version
+
+# Write the checkpoint of `version` if it falls on the table's checkpoint interval; returns whether one was written
+def maybe_write_checkpoint(table_path, version, actions_per_part=DEFAULT_CHECKPOINT_PART_SIZE, max_workers=8):
+  if version == 0 or version % checkpoint_interval(load_snapshot(table_path, version, with_stats=False)) != 0:
+    return False
+  write_checkpoint(table_path, version, actions_per_part, max_workers)
+  return True
+
+# Commit a new delta.checkpointInterval for the table; returns the version of that commit
+def set_checkpoint_interval(table_path, interval):
+  if interval < 1:
+    raise ValueError("Checkpoint interval must be at least 1, got %s" % interval)
+  return commit_table_properties(load_snapshot(table_path, with_stats=False), {"delta.checkpointInterval": str(interval)})
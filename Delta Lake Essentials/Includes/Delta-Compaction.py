@@ -0,0 +1,436 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Compaction
+# MAGIC
+# MAGIC Bin-packing compaction driven by the file sizes in the snapshot.
+# MAGIC
+# MAGIC `spark.read...repartition(numFiles).write.option("dataChange", "false").mode("overwrite")` rewrites every file of the table,
+# MAGIC including the ones that are already well sized. Instead:
+# MAGIC
+# MAGIC 1. `plan_compaction` takes the files smaller than `min_file_size` from the snapshot, groups them by partition
+# MAGIC    and packs them (first-fit decreasing) into bins of about `target_file_size` bytes.
+# MAGIC 2. `execute_compaction` rewrites each bin into one file and commits all of them as a single transaction whose
+# MAGIC    `add` and `remove` actions have `dataChange = false`, i.e. a pure rearrangement that streaming readers skip.
+# MAGIC
+# MAGIC The work is proportional to the bytes in small files, not to the size of the table.
+# MAGIC
+# MAGIC Usage:
+# MAGIC
+# MAGIC ```
+# MAGIC %run ./Includes/Delta-Compaction
+# MAGIC
+# MAGIC plan = plan_compaction(delta_path, target_file_size=128 * 1024 * 1024)
+# MAGIC print(plan.summary())
+# MAGIC execute_compaction(plan)
+# MAGIC
+# MAGIC # Nightly: only the partitions that received files since the previous incremental run
+# MAGIC execute_compaction(plan_incremental_compaction(delta_path, small_file_threshold=32 * 1024 * 1024))
+# MAGIC
+# MAGIC # Rewrite every file, ordered along a Z-order (or Hilbert) curve over the filter columns
+# MAGIC execute_compaction(plan_clustering(delta_path, ["InvoiceNo", "CustomerID"]))
+# MAGIC ```
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Snapshot
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Log-Writer
+
+# COMMAND ----------
+
+import builtins
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+DEFAULT_TARGET_FILE_SIZE = 128 * 1024 * 1024
+
+@dataclass
+class CompactionBin:
+  partition_values: Dict[str, Optional[str]]
+  files: List[AddFile] = field(default_factory=list)
+
+  @property
+  def size(self):
+    return builtins.sum(a.size for a in self.files)
+
+@dataclass
+class CompactionPlan:
+  table_path: str
+  read_version: int
+  partition_columns: List[str]
+  target_file_size: int
+  min_file_size: int
+  bins: List[CompactionBin] = field(default_factory=list)
+  table_files: int = 0
+  app_id: Optional[str] = None          # set for incremental runs: the txn appId that stores the high-water mark
+  high_water_mark: Optional[int] = None  # version the previous incremental run compacted through
+  cluster_by: Optional[List[str]] = None  # set for clustering runs: rows are ordered along `curve` over these columns
+  curve: str = "zorder"
+  metadata: Optional[Metadata] = None     # table metadata at read_version, handed to the write hooks
+
+  @property
+  def num_files(self):
+    return builtins.sum(len(b.files) for b in self.bins)
+
+  @property
+  def num_bytes(self):
+    return builtins.sum(b.size for b in self.bins)
+
+  def summary(self):
+    if self.cluster_by:
+      return ("Version %d: rewrite %d of %d files (%d bytes) into files of ~%d bytes, %s-ordered by %s in %d bins"
+              % (self.read_version, self.num_files, self.table_files, self.num_bytes, self.target_file_size,
+                 self.curve, ", ".join(self.cluster_by), len(self.bins)))
+    return ("Version %d: rewrite %d of %d files (%d bytes) into %d files of ~%d bytes"
+            % (self.read_version, self.num_files, self.table_files, self.num_bytes, len(self.bins), self.target_file_size))
+
+def _partition_key(partition_columns, partition_values):
+  return tuple(partition_values.get(c) for c in partition_columns)
+
+# First-fit decreasing: largest files first, each into the first bin of its partition with room left
+def _pack(files, partition_columns, target_file_size, keep_single_file_bins=False):
+  partitions = {}
+  for add in sorted(files, key=lambda a: a.size, reverse=True):
+    bins = partitions.setdefault(_partition_key(partition_columns, add.partition_values), [])
+    for b in bins:
+      if b.size + add.size <= target_file_size:
+        b.files.append(add)
+        break
+    else:
+      bins.append(CompactionBin(partition_values=dict(add.partition_values), files=[add]))
+  # A bin holding a single file would only rewrite it as is, unless its rows get reordered
+  return [b for bins in partitions.values() for b in bins if keep_single_file_bins or len(b.files) > 1]
+
+# Plan which files to rewrite. Files of at least min_file_size (3/4 of the target by default) are left alone.
+def plan_compaction(table_path, target_file_size=DEFAULT_TARGET_FILE_SIZE, min_file_size=None, snapshot=None):
+  if snapshot is None:
+    snapshot = load_snapshot(table_path, with_stats=False)
+  check_writable(snapshot)
+  if min_file_size is None:
+    min_file_size = target_file_size * 3 // 4
+  small_files = [a for a in snapshot.files.values() if a.size < min_file_size]
+  return CompactionPlan(table_path=table_path,
+                        read_version=snapshot.version,
+                        partition_columns=list(snapshot.partition_columns),
+                        target_file_size=target_file_size,
+                        min_file_size=min_file_size,
+                        bins=_pack(small_files, snapshot.partition_columns, target_file_size),
+                        table_files=snapshot.num_files,
+                        metadata=snapshot.metadata)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Incremental compaction
+# MAGIC
+# MAGIC Append-heavy tables (streaming `loans_delta`) only gain small files in the partitions that were written since the last run.
+# MAGIC Each incremental run records the version it compacted through as a `txn` action (appId `INCREMENTAL_COMPACTION_APP_ID`) in its own commit,
+# MAGIC the same mechanism streaming writers use to record their progress. The next run reads that high-water mark from the snapshot,
+# MAGIC replays only the commits after it to find the partitions that received new files, and plans bins for those partitions alone.
+
+# COMMAND ----------
+
+INCREMENTAL_COMPACTION_APP_ID = "delta-incremental-compaction"
+
+# Partition keys that received files in commits after `since_version`, or None when those commits are no longer in the log
+def _touched_partitions(table_path, snapshot, since_version):
+  if since_version >= snapshot.version:
+    return set()
+  try:
+    commits = read_commits(table_path, since_version + 1, snapshot.version)
+  except ValueError:
+    return None
+  if not commits or commits[0].version != since_version + 1:
+    return None
+  return {_partition_key(snapshot.partition_columns, a.partition_values) for c in commits for a in c.adds}
+
+# Plan a compaction of the files below small_file_threshold in the partitions written since the previous incremental run.
+# `partitions` optionally restricts the run further, e.g. [{"addr_state": "WA"}]. The first run (no high-water mark yet) covers the whole table.
+# A restricted run keeps its own high-water mark (appId suffixed with the partitions), so it never advances the mark of
+# unrestricted runs past partitions it did not look at.
+def plan_incremental_compaction(table_path, small_file_threshold, target_file_size=DEFAULT_TARGET_FILE_SIZE, partitions=None,
+                                app_id=INCREMENTAL_COMPACTION_APP_ID, snapshot=None):
+  if snapshot is None:
+    snapshot = load_snapshot(table_path, with_stats=False)
+  check_writable(snapshot)
+  columns = snapshot.partition_columns
+  if partitions is not None:
+    keys = sorted({_partition_key(columns, p) for p in partitions}, key=lambda k: json.dumps(k))
+    app_id = "%s/%s" % (app_id, json.dumps(keys, separators=(",", ":")))
+  txn = snapshot.txns.get(app_id)
+  high_water_mark = txn.version if txn is not None else -1
+  touched = _touched_partitions(table_path, snapshot, high_water_mark) if high_water_mark >= 0 else None
+  if partitions is not None:
+    allowed = {_partition_key(columns, p) for p in partitions}
+    touched = allowed if touched is None else touched & allowed
+  candidates = [a for a in snapshot.files.values()
+                if a.size < small_file_threshold and (touched is None or _partition_key(columns, a.partition_values) in touched)]
+  return CompactionPlan(table_path=table_path,
+                        read_version=snapshot.version,
+                        partition_columns=list(columns),
+                        target_file_size=target_file_size,
+                        min_file_size=small_file_threshold,
+                        bins=_pack(candidates, columns, target_file_size),
+                        table_files=snapshot.num_files,
+                        app_id=app_id,
+                        high_water_mark=high_water_mark,
+                        metadata=snapshot.metadata)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Clustering
+# MAGIC
+# MAGIC After `repartition` every file holds a random sample of the table, so each file's min/max range for `InvoiceNo` covers almost
+# MAGIC the whole column and a point lookup cannot skip any file. A clustering run rewrites whole partitions with their rows ordered
+# MAGIC along a space-filling curve over the chosen columns, then cuts the sorted rows into files of about the target size.
+# MAGIC Rows that are close in all of the columns end up in the same file, so every file covers a narrow range of each column.
+# MAGIC
+# MAGIC Each column is first mapped to its dense rank (so strings, dates and skewed numbers all spread evenly over the curve),
+# MAGIC scaled to `64 // len(columns)` bits, then the bits are interleaved:
+# MAGIC
+# MAGIC * `curve="zorder"` interleaves the bits as they are (what `OPTIMIZE ... ZORDER BY` does);
+# MAGIC * `curve="hilbert"` first applies Skilling's transform. A Hilbert curve never jumps across the space, so neighbouring files overlap less.
+
+# COMMAND ----------
+
+CLUSTERING_CURVES = ("zorder", "hilbert")
+
+# Dense rank of every row in `column` shifted so that the highest rank uses the top bit of [0, 2^bits); nulls sort last.
+# Shifting instead of multiplying cannot overflow uint64, even with a single 64-bit column.
+def _scaled_ranks(column, bits):
+  if getattr(pa.types, "is_string_view", lambda t: False)(column.type):
+    column = column.cast(pa.large_string())
+  ranks = pc.rank(column, sort_keys="ascending", tiebreaker="dense").to_numpy().astype(np.uint64) - np.uint64(1)
+  rank_bits = int(ranks.max()).bit_length() if len(ranks) else 0
+  if rank_bits == 0:
+    return ranks
+  if rank_bits > bits:
+    return ranks >> np.uint64(rank_bits - bits)
+  return ranks << np.uint64(bits - rank_bits)
+
+# Skilling's "AxesToTranspose": turns coordinates into the transposed Hilbert index, in place
+def _hilbert_transpose(coords, bits):
+  n = len(coords)
+  q = 1 << (bits - 1)
+  while q > 1:
+    p = np.uint64(q - 1)
+    for i in range(n):
+      high = (coords[i] & np.uint64(q)) != 0
+      if i == 0:
+        coords[0] = np.where(high, coords[0] ^ p, coords[0])
+        continue
+      # Invert the low bits of coords[0] where the bit is set, exchange them with coords[i] where it is not
+      t = np.where(high, np.uint64(0), (coords[0] ^ coords[i]) & p)
+      coords[0] = np.where(high, coords[0] ^ p, coords[0] ^ t)
+      coords[i] = coords[i] ^ t
+    q >>= 1
+  for i in range(1, n):
+    coords[i] = coords[i] ^ coords[i - 1]
+  t = np.zeros_like(coords[0])
+  q = 1 << (bits - 1)
+  while q > 1:
+    t = np.where((coords[n - 1] & np.uint64(q)) != 0, t ^ np.uint64(q - 1), t)
+    q >>= 1
+  return [c ^ t for c in coords]
+
+# Interleave the bits of the coordinates, most significant first, coords[0] leading
+def _interleave(coords, bits):
+  n = len(coords)
+  key = np.zeros_like(coords[0])
+  for b in range(bits - 1, -1, -1):
+    for i in range(n):
+      key = (key << np.uint64(1)) | ((coords[i] >> np.uint64(b)) & np.uint64(1))
+  return key
+
+# Position of every row of `table` along the curve over `columns`
+def curve_keys(table, columns, curve="zorder"):
+  if curve not in CLUSTERING_CURVES:
+    raise ValueError("Unknown curve %r, expected one of %s" % (curve, ", ".join(CLUSTERING_CURVES)))
+  bits = 64 // len(columns)
+  coords = [_scaled_ranks(table.column(c), bits) for c in columns]
+  if curve == "hilbert" and len(columns) > 1:
+    coords = _hilbert_transpose(coords, bits)
+  return _interleave(coords, bits)
+
+# `table` with its rows ordered along the curve
+def cluster_table(table, columns, curve="zorder"):
+  return table.take(pa.array(np.argsort(curve_keys(table, columns, curve), kind="stable")))
+
+# Cut `table` into `pieces` runs of consecutive rows of (nearly) equal length
+def _split_rows(table, pieces):
+  bounds = [table.num_rows * i // pieces for i in range(pieces + 1)]
+  return [table.slice(start, end - start) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+# Plan a clustering run: every file of each partition (or of `partitions` only, e.g. [{"addr_state": "WA"}]) is rewritten with its rows
+# ordered along `curve` over `columns`. A partition larger than max_bin_size (8 times the target by default) is clustered
+# in several independent bins, since each bin is sorted in memory.
+def plan_clustering(table_path, columns, target_file_size=DEFAULT_TARGET_FILE_SIZE, curve="zorder", max_bin_size=None,
+                    partitions=None, snapshot=None):
+  if snapshot is None:
+    snapshot = load_snapshot(table_path, with_stats=False)
+  check_writable(snapshot)
+  if curve not in CLUSTERING_CURVES:
+    raise ValueError("Unknown curve %r, expected one of %s" % (curve, ", ".join(CLUSTERING_CURVES)))
+  if not columns:
+    raise ValueError("No columns to cluster by")
+  partition_columns = snapshot.partition_columns
+  known = {f["name"] for f in snapshot.metadata.schema["fields"]}
+  for c in columns:
+    if c in partition_columns:
+      raise ValueError("%s is a partition column; all rows of a partition already share its value" % c)
+    if c not in known:
+      raise ValueError("%s is not a column of %s" % (c, table_path))
+  if max_bin_size is None:
+    max_bin_size = 8 * target_file_size
+  files = list(snapshot.files.values())
+  if partitions is not None:
+    allowed = {_partition_key(partition_columns, p) for p in partitions}
+    files = [a for a in files if _partition_key(partition_columns, a.partition_values) in allowed]
+  return CompactionPlan(table_path=table_path,
+                        read_version=snapshot.version,
+                        partition_columns=list(partition_columns),
+                        target_file_size=target_file_size,
+                        min_file_size=0,
+                        bins=_pack(files, partition_columns, max_bin_size, keep_single_file_bins=True),
+                        table_files=snapshot.num_files,
+                        cluster_by=list(columns),
+                        curve=curve,
+                        metadata=snapshot.metadata)
+
+# COMMAND ----------
+
+# Read the files of a bin as one Arrow table in the data columns of the table schema in `metadata`. Every file is read on its own:
+# files written before a column was added (mergeSchema) get nulls for it, and other writers' (castable) physical types are cast.
+def _read_data_files(table_path, files, metadata):
+  fields = [(f["name"], f["type"]) for f in metadata.schema["fields"] if f["name"] not in metadata.partition_columns]
+  tables = [pq.read_table(data_file_path(table_path, a.path), partitioning=None) for a in files]
+  schema = []
+  for name, delta_type in fields:
+    # Nested columns keep the type the files store them with
+    stored = [t.schema.field(name).type for t in tables if name in t.column_names]
+    schema.append((name, _arrow_type(delta_type) or (stored[0] if stored else pa.null())))
+  schema = pa.schema(schema)
+  return pa.concat_tables([pa.Table.from_arrays([t.column(f.name).cast(f.type) if f.name in t.column_names else pa.nulls(t.num_rows, f.type)
+                                                 for f in schema], schema=schema)
+                           for t in tables])
+
+# Rewrite one bin into new files: a single file, or for clustering runs the sorted rows split into files of about the target size.
+# Returns the (not yet committed) add and remove actions.
+def rewrite_bin(plan, compaction_bin):
+  metadata = plan.metadata or load_snapshot(plan.table_path, plan.read_version, with_stats=False).metadata
+  table = _read_data_files(plan.table_path, compaction_bin.files, metadata)
+  if plan.cluster_by:
+    pieces = _split_rows(cluster_table(table, plan.cluster_by, plan.curve),
+                         builtins.max(1, builtins.round(compaction_bin.size / plan.target_file_size)))
+  else:
+    pieces = [table]
+  adds = [write_data_file(plan.table_path, piece, plan.partition_columns, compaction_bin.partition_values, data_change=False,
+                          metadata=plan.metadata)
+          for piece in pieces]
+  deletion_timestamp = now_millis()
+  removes = [remove_for(a, deletion_timestamp, data_change=False) for a in compaction_bin.files]
+  return adds, removes
+
+def _compaction_commit_info(plan, bins, adds, removes, operation_parameters=None):
+  parameters = {"targetFileSize": plan.target_file_size, "minFileSize": plan.min_file_size}
+  if plan.app_id is not None:
+    parameters["incrementalSinceVersion"] = plan.high_water_mark
+  if plan.cluster_by:
+    # Same encoding as OPTIMIZE ... ZORDER BY
+    parameters["zOrderBy"] = json.dumps(plan.cluster_by)
+    parameters["curve"] = plan.curve
+  parameters.update(operation_parameters or {})
+  return CommitInfo(timestamp=now_millis(),
+                    operation="OPTIMIZE",
+                    operation_parameters=parameters,
+                    operation_metrics={"numAddedFiles": len(adds),
+                                       "numRemovedFiles": len(removes),
+                                       "numAddedBytes": builtins.sum(a.size for a in adds),
+                                       "numRemovedBytes": builtins.sum(r.size or 0 for r in removes),
+                                       "numBins": len(bins)},
+                    read_version=plan.read_version,
+                    is_blind_append=False)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Running next to streaming writers
+# MAGIC
+# MAGIC A compaction only reads files that were already committed at `plan.read_version`, and only removes those files.
+# MAGIC Streaming appends committed in the meantime add new files and remove none, so they cannot invalidate the rewrite.
+# MAGIC When the commit of `read_version + 1` loses the race, `execute_compaction(plan, max_retries=N)` reads the winning commits and checks them at file level:
+# MAGIC
+# MAGIC * a winner that removed a file of a bin (a DELETE, UPDATE, MERGE or another compaction) conflicts with that bin only;
+# MAGIC   the bin is rewritten from its files that are still active, or dropped when fewer than two are left;
+# MAGIC * a winner that changed the metadata or protocol, or recorded progress for the same incremental `appId`, conflicts with the whole run;
+# MAGIC * every other winner (blind appends) is ignored.
+# MAGIC
+# MAGIC The rewritten files of the other bins are kept, and the commit is retried as the version after the last winner,
+# MAGIC so continuous ingest never has to be paused. Files written for a discarded attempt are never committed and are left for VACUUM.
+
+# COMMAND ----------
+
+# Indexes of the bins whose files were removed by `winners`, and the removed paths.
+# Raises ConcurrentCommitError when a winner conflicts with the whole run.
+def _conflicting_bins(plan, bins, winners):
+  removed = set()
+  for commit in winners:
+    if commit.metadata is not None or commit.protocol is not None:
+      raise ConcurrentCommitError(plan.table_path, commit.version)
+    if plan.app_id is not None and any(t.app_id == plan.app_id for t in commit.txns):
+      raise ConcurrentCommitError(plan.table_path, commit.version)
+    removed.update(r.path for r in commit.removes)
+  return {i for i, b in enumerate(bins) if any(a.path in removed for a in b.files)}, removed
+
+def _compaction_actions(plan, bins, rewritten, version):
+  adds = [a for bin_adds, _ in rewritten for a in bin_adds]
+  removes = [r for _, bin_removes in rewritten for r in bin_removes]
+  actions = [_compaction_commit_info(plan, bins, adds, removes)] + removes + adds
+  if plan.app_id is not None:
+    # Without winners this commit covers everything up to and including itself. Otherwise the partitions the winners
+    # appended to were not looked at, so the next incremental run has to start right after the planned version again.
+    covered = version if version == plan.read_version + 1 else plan.read_version
+    actions.append(SetTransaction(app_id=plan.app_id, version=covered, last_updated=now_millis()))
+  return actions
+
+# Rewrite every bin of the plan and commit the result as version read_version + 1.
+# If another writer committed first, up to `max_retries` further attempts are made, rewriting only the bins it conflicts with (see above).
+# Raises ConcurrentCommitError when the retries are exhausted or the conflict cannot be resolved.
+def execute_compaction(plan, max_retries=0):
+  bins = list(plan.bins)
+  if not bins:
+    return None
+  rewritten = [rewrite_bin(plan, b) for b in bins]
+  version = plan.read_version + 1
+  for attempt in range(max_retries + 1):
+    try:
+      return write_commit(plan.table_path, version, _compaction_actions(plan, bins, rewritten, version))
+    except ConcurrentCommitError:
+      if attempt == max_retries:
+        raise
+    winners = read_commits(plan.table_path, version, latest_version(plan.table_path))
+    conflicts, removed = _conflicting_bins(plan, bins, winners)
+    retry_bins, retry_rewritten = [], []
+    for i, (compaction_bin, result) in enumerate(zip(bins, rewritten)):
+      if i not in conflicts:
+        retry_bins.append(compaction_bin)
+        retry_rewritten.append(result)
+        continue
+      remaining = [a for a in compaction_bin.files if a.path not in removed]
+      if len(remaining) > 1 or (plan.cluster_by and remaining):
+        compaction_bin = CompactionBin(partition_values=compaction_bin.partition_values, files=remaining)
+        retry_bins.append(compaction_bin)
+        retry_rewritten.append(rewrite_bin(plan, compaction_bin))
+    bins, rewritten = retry_bins, retry_rewritten
+    if not bins:
+      return None
+    version = winners[-1].version + 1
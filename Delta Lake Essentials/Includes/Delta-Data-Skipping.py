@@ -0,0 +1,270 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Data Skipping
+# MAGIC
+# MAGIC Every `add` action records `minValues`, `maxValues` and `nullCount` of the file's columns in `add.stats`.
+# MAGIC `build_skipping_index` decodes them once into one Arrow array per statistic and column (one entry per active file),
+# MAGIC plus the partition values, which are the min and max of their column in every file of a partition.
+# MAGIC `candidate_files` then evaluates a predicate against all files at once and returns only the files whose ranges can contain a match.
+# MAGIC A file without stats for a column can never be skipped on that column.
+# MAGIC
+# MAGIC Predicates use the `filters` format of `pyarrow.parquet`: a list of `(column, op, value)` terms that must all hold,
+# MAGIC or a list of such lists, any of which may hold. `op` is one of `=`, `==`, `!=`, `<`, `<=`, `>`, `>=`, `in`, `not in`,
+# MAGIC `is null` and `is not null`.
+# MAGIC
+# MAGIC Usage:
+# MAGIC
+# MAGIC ```
+# MAGIC %run ./Includes/Delta-Data-Skipping
+# MAGIC
+# MAGIC index = build_skipping_index(deltaPath)
+# MAGIC index.candidate_files([("InvoiceNo", "=", 536365)])
+# MAGIC index.candidate_files([[("addr_state", "in", ["WA", "CA"]), ("funded_amnt", ">=", 9000)], [("loan_id", "<", 100)]])
+# MAGIC ```
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Snapshot
+
+# COMMAND ----------
+
+import builtins
+import datetime
+from dataclasses import dataclass
+from urllib.parse import unquote
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Delta primitive types that can be skipped on, and the Arrow type their stats are held in.
+# Decimals are left out: their JSON stats are floats, which cannot be compared exactly.
+_SKIPPING_TYPES = {
+  "byte": pa.int64(), "short": pa.int64(), "integer": pa.int64(), "long": pa.int64(),
+  "float": pa.float64(), "double": pa.float64(),
+  "string": pa.string(), "boolean": pa.bool_(),
+  "date": pa.date32(), "timestamp": pa.timestamp("us"), "timestamp_ntz": pa.timestamp("us"),
+}
+
+# Python value of a stats or partition value (JSON number, ISO string, ...) for a column of `delta_type`
+def _typed_value(delta_type, value):
+  if value is None:
+    return None
+  if delta_type in ("byte", "short", "integer", "long"):
+    return int(value)
+  if delta_type in ("float", "double"):
+    return float(value)
+  if delta_type == "boolean":
+    return value if isinstance(value, bool) else str(value).lower() == "true"
+  if delta_type == "date":
+    return value if isinstance(value, datetime.date) else datetime.date.fromisoformat(str(value)[:10])
+  if delta_type in ("timestamp", "timestamp_ntz"):
+    if not isinstance(value, datetime.datetime):
+      value = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    # Timestamps are compared in UTC, without time zone
+    if value.tzinfo is not None:
+      value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+  return str(value)
+
+# [[term, ...], ...]: a disjunction of conjunctions, from either filters format
+def _normalize_filters(filters):
+  if not filters:
+    return [[]]
+  if isinstance(filters[0], tuple):
+    return [list(filters)]
+  return [list(conjunction) for conjunction in filters]
+
+@dataclass
+class ColumnStats:
+  delta_type: str
+  min_values: pa.Array
+  max_values: pa.Array
+  null_counts: pa.Array    # int64, null when unknown
+
+class DataSkippingIndex:
+
+  def __init__(self, table_path, version, files, num_records, columns):
+    self.table_path = table_path
+    self.version = version
+    self.files = files                  # AddFile of every indexed file, in index order
+    self.num_records = num_records      # int64 array, null when the file has no stats
+    self.columns = columns              # column name -> ColumnStats
+
+  def __repr__(self):
+    return "DataSkippingIndex(%s, version=%d, files=%d, columns=%s)" % (self.table_path, self.version, len(self.files), sorted(self.columns))
+
+  def __len__(self):
+    return len(self.files)
+
+  # Boolean mask over the files: False where the file certainly holds no row matching (column, op, value)
+  def _term_mask(self, column, op, value):
+    stats = self.columns.get(column)
+    if stats is None:
+      return np.ones(len(self.files), dtype=bool)
+    op = op.lower()
+    all_null = pc.fill_null(pc.equal(stats.null_counts, self.num_records), False)
+    if op == "is null":
+      return pc.fill_null(pc.greater(stats.null_counts, 0), True).to_numpy(zero_copy_only=False)
+    if op == "is not null":
+      return pc.invert(all_null).to_numpy(zero_copy_only=False)
+    if op in ("in", "not in"):
+      typed = [_typed_value(stats.delta_type, v) for v in value]
+      values = [v for v in typed if v is not None]
+      if op == "in" and len(values) < len(typed):
+        # A NULL in the list is kept conservatively: files with nulls may match
+        with_nulls = pc.fill_null(pc.greater(stats.null_counts, 0), True).to_numpy(zero_copy_only=False)
+        return with_nulls | (self._term_mask(column, op, values) if values else False)
+      if not values:
+        return np.ones(len(self.files), dtype=bool)
+    else:
+      values = [_typed_value(stats.delta_type, value)]
+      if values[0] is None:
+        # Comparisons with NULL never match
+        return np.zeros(len(self.files), dtype=bool) if op != "!=" else np.ones(len(self.files), dtype=bool)
+    arrow_type = stats.min_values.type
+    scalars = [pa.scalar(v, type=arrow_type) for v in values]
+    lo, hi = stats.min_values, stats.max_values
+
+    if op in ("=", "==", "in"):
+      mask = None
+      for s in scalars:
+        term = pc.and_kleene(pc.less_equal(lo, s), pc.greater_equal(hi, s))
+        mask = term if mask is None else pc.or_kleene(mask, term)
+    elif op in ("!=", "not in"):
+      # Only a file whose every value is one of the excluded ones can be skipped
+      mask = None
+      for s in scalars:
+        term = pc.and_kleene(pc.equal(lo, s), pc.equal(hi, s))
+        mask = term if mask is None else pc.or_kleene(mask, term)
+      mask = pc.invert(mask)
+    elif op == "<":
+      mask = pc.less(lo, scalars[0])
+    elif op == "<=":
+      mask = pc.less_equal(lo, scalars[0])
+    elif op == ">":
+      mask = pc.greater(hi, scalars[0])
+    elif op == ">=":
+      mask = pc.greater_equal(hi, scalars[0])
+    else:
+      raise ValueError("Unsupported operator %r" % op)
+    # Unknown stats may match; a column that is entirely null matches no comparison
+    mask = pc.and_(pc.fill_null(mask, True), pc.invert(all_null))
+    return mask.to_numpy(zero_copy_only=False)
+
+  # Boolean mask over the files that may hold rows matching `filters`
+  def mask(self, filters):
+    result = np.zeros(len(self.files), dtype=bool)
+    for conjunction in _normalize_filters(filters):
+      conjunction_mask = np.ones(len(self.files), dtype=bool)
+      for column, op, value in conjunction:
+        conjunction_mask &= self._term_mask(column, op, value)
+      result |= conjunction_mask
+    return result
+
+  # Boolean mask over the files: True where the stats prove that every row of the file matches (column, op, value).
+  # Float and timestamp min/max never prove a comparison: NaNs are left out of them and timestamps are truncated to milliseconds.
+  def _term_all_mask(self, column, op, value):
+    stats = self.columns.get(column)
+    op = op.lower()
+    if stats is None or (op not in ("is null", "is not null") and stats.delta_type in ("float", "double", "timestamp", "timestamp_ntz")):
+      return np.zeros(len(self.files), dtype=bool)
+    no_nulls = pc.equal(stats.null_counts, 0)
+    if op == "is null":
+      mask = pc.equal(stats.null_counts, self.num_records)
+    elif op == "is not null":
+      mask = no_nulls
+    else:
+      values = [_typed_value(stats.delta_type, v) for v in (value if op in ("in", "not in") else [value])]
+      values = [v for v in values if v is not None]
+      if not values:
+        return np.zeros(len(self.files), dtype=bool)
+      scalars = [pa.scalar(v, type=stats.min_values.type) for v in values]
+      # Truncated string stats are a lower bound (min) and an upper bound (max), which is all the checks below rely on
+      lo, hi = stats.min_values, stats.max_values
+      if op in ("=", "==", "in"):
+        mask = None
+        for s in scalars:
+          term = pc.and_(pc.equal(lo, s), pc.equal(hi, s))
+          mask = term if mask is None else pc.or_(mask, term)
+      elif op in ("!=", "not in"):
+        mask = None
+        for s in scalars:
+          term = pc.or_(pc.less(hi, s), pc.greater(lo, s))
+          mask = term if mask is None else pc.and_(mask, term)
+      elif op == "<":
+        mask = pc.less(hi, scalars[0])
+      elif op == "<=":
+        mask = pc.less_equal(hi, scalars[0])
+      elif op == ">":
+        mask = pc.greater(lo, scalars[0])
+      elif op == ">=":
+        mask = pc.greater_equal(lo, scalars[0])
+      else:
+        raise ValueError("Unsupported operator %r" % op)
+      # A NULL never satisfies a comparison
+      mask = pc.and_(mask, no_nulls)
+    return pc.fill_null(mask, False).to_numpy(zero_copy_only=False)
+
+  # Boolean mask over the files whose every row matches `filters`, by their stats alone
+  def all_rows_mask(self, filters):
+    result = np.zeros(len(self.files), dtype=bool)
+    for conjunction in _normalize_filters(filters):
+      conjunction_mask = np.ones(len(self.files), dtype=bool)
+      for column, op, value in conjunction:
+        conjunction_mask &= self._term_all_mask(column, op, value)
+      result |= conjunction_mask
+    return result
+
+  # The AddFiles that may hold rows matching `filters`
+  def candidate_files(self, filters):
+    return [self.files[i] for i in np.flatnonzero(self.mask(filters))]
+
+  # Local paths of the candidate files, e.g. to read them with spark.read.parquet or pyarrow
+  def candidate_paths(self, filters):
+    return [data_file_path(self.table_path, a.path) for a in self.candidate_files(filters)]
+
+  # The candidate files as paths under table_path, e.g. dbfs:/... for spark.read.format("parquet").load(...)
+  def candidate_uris(self, filters):
+    return [a.path if "://" in a.path or a.path.startswith(("/", "dbfs:")) else "%s/%s" % (self.table_path.rstrip("/"), unquote(a.path))
+            for a in self.candidate_files(filters)]
+
+  def skipping_summary(self, filters):
+    candidates = self.candidate_files(filters)
+    return ("%d of %d files (%d of %d bytes) may match %s"
+            % (len(candidates), len(self.files), builtins.sum(a.size for a in candidates), builtins.sum(a.size for a in self.files), filters))
+
+# COMMAND ----------
+
+# Index the stats of the active files at `version` (latest when None).
+# `columns` restricts the index to some top-level columns; by default every column of a supported type is indexed.
+def build_skipping_index(table_path, version=None, columns=None, snapshot=None):
+  if snapshot is None:
+    snapshot = load_snapshot(table_path, version)
+  fields = {f["name"]: f["type"] for f in snapshot.metadata.schema["fields"]
+            if isinstance(f["type"], str) and f["type"] in _SKIPPING_TYPES}
+  if columns is not None:
+    fields = {c: t for c, t in fields.items() if c in columns}
+  partition_columns = set(snapshot.partition_columns)
+
+  files = list(snapshot.files.values())
+  parsed = [a.parsed_stats() or {} for a in files]
+  num_records = pa.array([s.get("numRecords") for s in parsed], type=pa.int64())
+  indexed = {}
+  for name, delta_type in fields.items():
+    arrow_type = _SKIPPING_TYPES[delta_type]
+    if name in partition_columns:
+      # Every row of the file has the partition value
+      values = [_typed_value(delta_type, a.partition_values.get(name)) for a in files]
+      null_counts = [r if v is None else 0 for v, r in zip(values, num_records.to_pylist())]
+      min_values = max_values = pa.array(values, type=arrow_type)
+    else:
+      min_values = pa.array([_typed_value(delta_type, s.get("minValues", {}).get(name)) for s in parsed], type=arrow_type)
+      max_values = [_typed_value(delta_type, s.get("maxValues", {}).get(name)) for s in parsed]
+      if delta_type in ("timestamp", "timestamp_ntz"):
+        # Timestamp stats are truncated to milliseconds, so the true maximum can be up to 1 ms above maxValues
+        max_values = [None if v is None else v + datetime.timedelta(milliseconds=1) for v in max_values]
+      max_values = pa.array(max_values, type=arrow_type)
+      null_counts = [s.get("nullCount", {}).get(name) for s in parsed]
+    indexed[name] = ColumnStats(delta_type, min_values, max_values, pa.array(null_counts, type=pa.int64()))
+  return DataSkippingIndex(table_path, snapshot.version, files, num_records, indexed)
@@ -0,0 +1,165 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Key Locator
+# MAGIC
+# MAGIC Finding the file that holds an invoice with `input_file_name()` scans the whole table every time.
+# MAGIC `KeyLocator` reads the key column of every active file once (only that column, in parallel) and keeps a map
+# MAGIC from key value to the files holding it. A lookup is then a dictionary access.
+# MAGIC
+# MAGIC The map is version-stamped: every file records the version that added it and the version that removed it,
+# MAGIC so `locate(key, version)` answers for any version from the one the locator was built at up to the one it has caught up to.
+# MAGIC `update` reads only the commits written since, and `start` follows the table with `DeltaLogTailer` on a background thread.
+# MAGIC Files removed before `prune(version)` are forgotten, bounding the memory of a long-running locator.
+# MAGIC
+# MAGIC Usage:
+# MAGIC
+# MAGIC ```
+# MAGIC %run ./Includes/Delta-Key-Locator
+# MAGIC
+# MAGIC locator = KeyLocator(deltaPath, "InvoiceNo")
+# MAGIC locator.locate(536365)               # ['part-00000-....snappy.parquet']
+# MAGIC locator.update()                     # catch up with new commits
+# MAGIC locator.locate(536365, version=3)
+# MAGIC ```
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Data-Skipping
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Log-Tailer
+
+# COMMAND ----------
+
+import builtins
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+class KeyLocator:
+
+  def __init__(self, table_path, key_column, version=None, max_workers=8):
+    self.table_path = table_path
+    self.key_column = key_column
+    self.max_workers = max_workers
+    self._lock = threading.Lock()
+    self._tailer = None
+    self._build(load_snapshot(table_path, version, with_stats=False))
+
+  def __repr__(self):
+    return ("KeyLocator(%s, %s, versions=%d..%d, files=%d, keys=%d)"
+            % (self.table_path, self.key_column, self.base_version, self.version, len(self._active), len(self._keys)))
+
+  # Index the active files of `snapshot`, dropping everything known before
+  def _build(self, snapshot):
+    types = {f["name"]: f["type"] for f in snapshot.metadata.schema["fields"]}
+    if self.key_column not in types:
+      raise ValueError("%s has no column %s at version %d" % (self.table_path, self.key_column, snapshot.version))
+    self.key_type = types[self.key_column]
+    self.partition_columns = list(snapshot.partition_columns)
+    self.base_version = self.version = snapshot.version
+    # Per file id: add path, version range [added, removed) and the distinct keys, kept to unlink them on prune
+    self._paths, self._added, self._removed, self._file_keys = [], [], [], []
+    self._active = {}   # add.path -> file id of the files in the latest version
+    self._keys = {}     # key -> file id, or a tuple of file ids when several files hold the key
+    self._add_files(list(snapshot.files.values()), snapshot.version)
+
+  # Distinct keys of one data file: its partition value, or the key column read from the file
+  def _read_keys(self, add):
+    if self.key_column in self.partition_columns:
+      return [_typed_value(self.key_type, add.partition_values.get(self.key_column))]
+    column = pq.read_table(data_file_path(self.table_path, add.path), columns=[self.key_column]).column(0)
+    return [_typed_value(self.key_type, v) for v in pc.unique(column).to_pylist()]
+
+  def _add_files(self, adds, version):
+    if not adds:
+      return
+    with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+      file_keys = list(pool.map(self._read_keys, adds))
+    with self._lock:
+      for add, keys in zip(adds, file_keys):
+        if add.path in self._active:
+          self._remove_file(add.path, version)
+        file_id = len(self._paths)
+        self._paths.append(add.path)
+        self._added.append(version)
+        self._removed.append(None)
+        self._file_keys.append(keys)
+        self._active[add.path] = file_id
+        for key in keys:
+          ids = self._keys.get(key)
+          self._keys[key] = file_id if ids is None else (ids if isinstance(ids, tuple) else (ids,)) + (file_id,)
+
+  def _remove_file(self, path, version):
+    file_id = self._active.pop(path, None)
+    if file_id is not None:
+      self._removed[file_id] = version
+
+  # Apply one commit, the next version after self.version
+  def apply_commit(self, commit):
+    if commit.version != self.version + 1:
+      raise ValueError("Expected version %d of %s, got %d" % (self.version + 1, self.table_path, commit.version))
+    if commit.metadata is not None:
+      types = {f["name"]: f["type"] for f in commit.metadata.schema["fields"]}
+      if types.get(self.key_column) != self.key_type or list(commit.metadata.partition_columns) != self.partition_columns:
+        # The key column changed type or partitioning: the keys already read no longer apply
+        self._build(load_snapshot(self.table_path, commit.version, with_stats=False))
+        return
+    with self._lock:
+      for remove in commit.removes:
+        self._remove_file(remove.path, commit.version)
+    self._add_files(commit.adds, commit.version)
+    self.version = commit.version
+
+  # Catch up with the commits written since the last update, up to `version` (the latest when None)
+  def update(self, version=None):
+    for commit in iter_commits(self.table_path, self.version + 1, version):
+      self.apply_commit(commit)
+    return self.version
+
+  # Add paths of the files holding rows with `key` at `version` (the version the locator is at when None)
+  def locate(self, key, version=None):
+    if version is None:
+      version = self.version
+    elif version > self.version:
+      self.update(version)
+    if version < self.base_version:
+      raise ValueError("%s is located from version %d on, not %d" % (self.table_path, self.base_version, version))
+    with self._lock:
+      ids = self._keys.get(_typed_value(self.key_type, key))
+      if ids is None:
+        return []
+      return [self._paths[i] for i in (ids if isinstance(ids, tuple) else (ids,))
+              if self._added[i] <= version and (self._removed[i] is None or self._removed[i] > version)]
+
+  # Local paths of those files, e.g. to read them with pyarrow
+  def locate_paths(self, key, version=None):
+    return [data_file_path(self.table_path, p) for p in self.locate(key, version)]
+
+  # Forget the files removed at or before `version`; versions before it can no longer be located
+  def prune(self, version=None):
+    version = self.version if version is None else builtins.min(version, self.version)
+    with self._lock:
+      for file_id, removed in enumerate(self._removed):
+        if removed is None or removed > version or self._file_keys[file_id] is None:
+          continue
+        for key in self._file_keys[file_id]:
+          ids = tuple(i for i in (self._keys[key] if isinstance(self._keys[key], tuple) else (self._keys[key],)) if i != file_id)
+          if not ids:
+            del self._keys[key]
+          else:
+            self._keys[key] = ids[0] if len(ids) == 1 else ids
+        self._file_keys[file_id] = None
+      self.base_version = builtins.max(self.base_version, version)
+
+  # Follow the table on a background thread, checking for new commits every `interval` seconds
+  def start(self, interval=1.0):
+    self._tailer = DeltaLogTailer(self.table_path, start_version=self.version + 1)
+    return self._tailer.follow_in_background(self.apply_commit, interval)
+
+  def stop(self):
+    if self._tailer is not None:
+      self._tailer.stop()
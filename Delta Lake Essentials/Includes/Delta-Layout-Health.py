@@ -0,0 +1,110 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Layout Health
+# MAGIC
+# MAGIC `file_count(deltaPath)` counts the Parquet files on disk. That includes tombstoned files still waiting for VACUUM,
+# MAGIC and says nothing about how big the files are. `layout_health` looks at the active files of the snapshot instead and reports
+# MAGIC
+# MAGIC * the active file count, and the tombstones in the log (removed files, some of which VACUUM may already have deleted),
+# MAGIC * file-size percentiles and the share of files below the target size,
+# MAGIC * the estimated per-file open overhead of a full scan, using Spark's own cost model (`spark.sql.files.openCostInBytes`, 4 MB by default),
+# MAGIC * whether the table has drifted into the small-file state (like the table repartitioned into 500 files in notebook 4).
+# MAGIC
+# MAGIC Usage:
+# MAGIC
+# MAGIC ```
+# MAGIC %run ./Includes/Delta-Layout-Health
+# MAGIC
+# MAGIC health = layout_health(deltaPath)
+# MAGIC print(health.summary())
+# MAGIC health.to_metrics()   # flat {"delta.layout.num_files": ..., ...} dict for a metrics sink
+# MAGIC ```
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Snapshot
+
+# COMMAND ----------
+
+import builtins
+import math
+from dataclasses import asdict, dataclass
+
+DEFAULT_TARGET_FILE_SIZE = 128 * 1024 * 1024
+DEFAULT_OPEN_COST_IN_BYTES = 4 * 1024 * 1024
+
+@dataclass
+class LayoutHealth:
+  version: int
+  num_files: int
+  num_tombstones: int         # remove actions still in the log; their files are not checked on disk
+  total_bytes: int
+  target_file_size: int
+  min_size: int
+  p10_size: int
+  p50_size: int
+  p90_size: int
+  max_size: int
+  small_files: int            # files below small_file_size
+  small_file_ratio: float
+  expected_files: int         # files the table would have at the target size
+  open_overhead_bytes: int    # num_files * openCostInBytes: what Spark charges for opening the files of a full scan
+  open_overhead_ratio: float  # share of a full scan's cost spent opening files
+  needs_compaction: bool
+
+  def summary(self):
+    return ("Version %d: %d files (%d expected at target size), %d bytes, median file %d bytes, %.0f%% small files, "
+            "%.0f%% of scan cost is file opens%s"
+            % (self.version, self.num_files, self.expected_files, self.total_bytes, self.p50_size,
+               100 * self.small_file_ratio, 100 * self.open_overhead_ratio,
+               " -> compaction recommended" if self.needs_compaction else ""))
+
+  def to_metrics(self, prefix="delta.layout"):
+    return {"%s.%s" % (prefix, k): (int(v) if isinstance(v, bool) else v) for k, v in asdict(self).items()}
+
+# Nearest-rank percentile of an already sorted list
+def _percentile(sorted_values, fraction):
+  if not sorted_values:
+    return 0
+  return sorted_values[builtins.min(len(sorted_values) - 1, builtins.max(0, math.ceil(fraction * len(sorted_values)) - 1))]
+
+# Layout metrics of the table at `version` (latest when None).
+# A table needs compaction when at least `max_small_file_ratio` of its files are below small_file_size (half the target by default)
+# and it has more than `max_file_ratio` times the files it would have at the target size.
+def layout_health(table_path, version=None, target_file_size=DEFAULT_TARGET_FILE_SIZE, small_file_size=None,
+                  open_cost_in_bytes=DEFAULT_OPEN_COST_IN_BYTES, max_small_file_ratio=0.5, max_file_ratio=4, snapshot=None):
+  if snapshot is None:
+    snapshot = load_snapshot(table_path, version, with_stats=False)
+  if small_file_size is None:
+    small_file_size = target_file_size // 2
+  sizes = sorted(a.size for a in snapshot.files.values())
+  total_bytes = builtins.sum(sizes)
+  small_files = builtins.sum(1 for s in sizes if s < small_file_size)
+  small_file_ratio = small_files / len(sizes) if sizes else 0.0
+  expected_files = builtins.max(1, math.ceil(total_bytes / target_file_size)) if sizes else 0
+  open_overhead_bytes = len(sizes) * open_cost_in_bytes
+  return LayoutHealth(version=snapshot.version,
+                      num_files=len(sizes),
+                      num_tombstones=len(snapshot.tombstones),
+                      total_bytes=total_bytes,
+                      target_file_size=target_file_size,
+                      min_size=sizes[0] if sizes else 0,
+                      p10_size=_percentile(sizes, 0.1),
+                      p50_size=_percentile(sizes, 0.5),
+                      p90_size=_percentile(sizes, 0.9),
+                      max_size=sizes[-1] if sizes else 0,
+                      small_files=small_files,
+                      small_file_ratio=small_file_ratio,
+                      expected_files=expected_files,
+                      open_overhead_bytes=open_overhead_bytes,
+                      open_overhead_ratio=open_overhead_bytes / (open_overhead_bytes + total_bytes) if sizes else 0.0,
+                      needs_compaction=small_file_ratio >= max_small_file_ratio and len(sizes) > max_file_ratio * expected_files)
+
+# Flag every table in `table_paths` that needs compaction: {path: LayoutHealth}
+def find_unhealthy_tables(table_paths, **kwargs):
+  unhealthy = {}
+  for path in table_paths:
+    health = layout_health(path, **kwargs)
+    if health.needs_compaction:
+      unhealthy[path] = health
+  return unhealthy
@@ -0,0 +1,339 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Local Query
+# MAGIC
+# MAGIC Spark is overkill for a table of a few thousand rows: `SELECT count(*)` pays for scheduling a job before it reads anything.
+# MAGIC `LocalDeltaTable` answers such queries in the driver's Python process, without a JVM:
+# MAGIC
+# MAGIC 1. the snapshot of the version is resolved from `_delta_log` (`./Delta-Snapshot`),
+# MAGIC 2. the min/max stats of `./Delta-Data-Skipping` drop the files that cannot match the filters,
+# MAGIC 3. the remaining Parquet files are read in parallel with Arrow, only the columns the query needs,
+# MAGIC 4. partition values are added as columns, rows are filtered and aggregated with `pyarrow.compute`.
+# MAGIC
+# MAGIC `filters` use the `pyarrow.parquet` format of `./Delta-Data-Skipping` and are used both to skip files and to filter rows.
+# MAGIC `where` takes any `pyarrow.compute` expression, such as a comparison of two columns; it only filters rows.
+# MAGIC Tables with table features (deletion vectors, column mapping, ...) are refused rather than read wrong.
+# MAGIC
+# MAGIC `count`, and `aggregate` of count / min / max (ungrouped or grouped by partition columns), open no data file they don't need to:
+# MAGIC a file whose stats prove that all its rows match the filters is answered from `numRecords`, `nullCount`, `minValues`, `maxValues`
+# MAGIC and its partition values. Only files without stats, files the filters match partly, or whose stats are not exact
+# MAGIC (float and timestamp min/max, truncated strings) are scanned. `explain_aggregate` shows the split.
+# MAGIC
+# MAGIC Usage:
+# MAGIC
+# MAGIC ```
+# MAGIC %run ./Includes/Delta-Local-Query
+# MAGIC
+# MAGIC loans = LocalDeltaTable(deltaPath)
+# MAGIC loans.count()
+# MAGIC loans.aggregate([("*", "count"), ("paid_amnt", "count"), ("loan_id", "max")], filters=[("addr_state", "=", "WA")])
+# MAGIC loans.explain_aggregate([("*", "count")], filters=[("addr_state", "=", "WA")])   # '5 files from stats, 0 scanned, 16 skipped'
+# MAGIC loans.scan(["loan_id", "funded_amnt"], filters=[("addr_state", "=", "NY"), ("loan_id", "<", 30)]).to_pandas()
+# MAGIC loans.aggregate([("funded_amnt", "sum")], group_by=["addr_state"], where=pc.field("funded_amnt") != pc.field("paid_amnt"))
+# MAGIC ```
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Data-Skipping
+
+# COMMAND ----------
+
+import builtins
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# pyarrow.compute expression of one (column, op, value) term, with SQL semantics: NULL never matches a comparison
+def _term_expression(column, op, value, delta_type):
+  field = pc.field(column)
+  op = op.lower()
+  if op == "is null":
+    return field.is_null()
+  if op == "is not null":
+    return field.is_valid()
+  # Literals are converted the way data skipping reads them, so "536365" matches an integer column
+  convert = (lambda v: v) if delta_type in ("timestamp", "timestamp_ntz") or delta_type not in _SKIPPING_TYPES \
+            else (lambda v: _typed_value(delta_type, v))
+  if op in ("in", "not in"):
+    values = [convert(v) for v in value if v is not None]
+    return field.isin(values) if op == "in" else (~field.isin(values)) & field.is_valid()
+  value = convert(value)
+  if op in ("=", "=="):
+    return field == value
+  if op == "!=":
+    return field != value
+  if op == "<":
+    return field < value
+  if op == "<=":
+    return field <= value
+  if op == ">":
+    return field > value
+  if op == ">=":
+    return field >= value
+  raise ValueError("Unsupported operator %r" % op)
+
+# Row filter of `filters` (either format), or None when there is none
+def _filter_expression(filters, types):
+  expression = None
+  for conjunction in _normalize_filters(filters):
+    if not conjunction:
+      return None
+    term = None
+    for column, op, value in conjunction:
+      t = _term_expression(column, op, value, types.get(column))
+      term = t if term is None else term & t
+    expression = term if expression is None else expression | term
+  return expression
+
+# Columns referenced by `filters`
+def _filter_columns(filters):
+  return {column for conjunction in _normalize_filters(filters) for column, _, _ in conjunction}
+
+# Aggregate functions that stats can answer, and the types whose min/max stats are the exact values.
+# Float stats leave NaNs out and timestamp stats are truncated to milliseconds.
+_STATS_AGGREGATES = ("count_all", "count", "min", "max")
+_EXACT_STATS_TYPES = {"byte", "short", "integer", "long", "date", "string"}
+DEFAULT_STRING_STATS_PREFIX_LENGTH = 32
+
+# (column, function) pairs in pyarrow's form: ("*", "count") is ([], "count_all")
+def _aggregate_specs(aggregations):
+  return [([], "count_all") if (column, function) in (("*", "count"), ("*", "count_all")) else (column, function)
+          for column, function in aggregations]
+
+# Result column of an aggregation, as pyarrow names it
+def _aggregate_name(column, function):
+  return function if column == [] else "%s_%s" % (column, function)
+
+# COMMAND ----------
+
+class LocalDeltaTable:
+
+  def __init__(self, table_path, version=None, max_workers=8):
+    self.table_path = table_path
+    self.max_workers = max_workers
+    self.snapshot = load_snapshot(table_path, version)
+    protocol = self.snapshot.protocol
+    column_mapping = (self.snapshot.metadata.configuration or {}).get("delta.columnMapping.mode", "none")
+    if (protocol is not None and protocol.min_reader_version >= 3) or column_mapping != "none":
+      # Deletion vectors and column mapping change how the files must be read
+      raise ValueError("%s uses table features; query it with Spark" % table_path)
+    self.version = self.snapshot.version
+    self.fields = {f["name"]: f["type"] for f in self.snapshot.metadata.schema["fields"]}
+    self.columns = list(self.fields)
+    self.partition_columns = self.snapshot.partition_columns
+    # Longer string stats may be truncated prefixes, which are no exact min/max
+    self.string_prefix_length = int((self.snapshot.metadata.configuration or {}).get(
+      "delta.dataSkippingStringPrefixLength", DEFAULT_STRING_STATS_PREFIX_LENGTH))
+    self._skipping_index = None
+
+  def __repr__(self):
+    return "LocalDeltaTable(%s, version=%d, files=%d)" % (self.table_path, self.version, self.snapshot.num_files)
+
+  @property
+  def skipping_index(self):
+    if self._skipping_index is None:
+      self._skipping_index = build_skipping_index(self.table_path, snapshot=self.snapshot)
+    return self._skipping_index
+
+  # The active files that may hold rows matching `filters`
+  def files(self, filters=None):
+    if not filters:
+      return list(self.snapshot.files.values())
+    return self.skipping_index.candidate_files(filters)
+
+  # `columns` of one data file, partition values included, cast to the table schema. Columns added to the table
+  # after the file was written are null.
+  def _read_file(self, add, columns):
+    parquet_file = pq.ParquetFile(data_file_path(self.table_path, add.path))
+    stored = set(parquet_file.schema_arrow.names)
+    data = parquet_file.read(columns=[c for c in columns if c in stored and c not in self.partition_columns])
+    if not columns:
+      return data
+    arrays = []
+    for c in columns:
+      arrow_type = _arrow_type(self.fields[c])
+      if c in self.partition_columns:
+        value = _typed_value(self.fields[c], add.partition_values.get(c)) if self.fields[c] in _SKIPPING_TYPES \
+                else add.partition_values.get(c)
+        arrays.append(pa.array([value] * data.num_rows, type=arrow_type or pa.string()))
+      elif c in stored:
+        column = data.column(c)
+        arrays.append(column if arrow_type is None or column.type == arrow_type else column.cast(arrow_type))
+      else:
+        arrays.append(pa.nulls(data.num_rows, type=arrow_type or pa.null()))
+    return pa.Table.from_arrays(arrays, names=list(columns))
+
+  # One filtered table per candidate file, in file order
+  # `files` restricts the scan to some of the candidate files.
+  def _scan_files(self, columns, filters, where, limit=None, files=None):
+    if columns is None:
+      columns = self.columns
+    unknown = [c for c in list(columns) + list(_filter_columns(filters)) if c not in self.fields]
+    if unknown:
+      raise ValueError("%s has no columns %s" % (self.table_path, unknown))
+    expression = _filter_expression(filters, self.fields)
+    if where is not None:
+      expression = where if expression is None else expression & where
+    # An arbitrary `where` expression may use any column, so all of them are read and projected afterwards
+    read_columns = list(columns) if expression is None else \
+                   self.columns if where is not None else list(dict.fromkeys(list(columns) + sorted(_filter_columns(filters))))
+
+    def read(add):
+      data = self._read_file(add, read_columns)
+      if expression is not None:
+        data = data.filter(expression)
+      return data.select(list(columns)) if read_columns != list(columns) else data
+
+    if files is None:
+      files = self.files(filters)
+    if limit is not None:
+      # Read file by file until there are enough rows
+      tables, rows = [], 0
+      for add in files:
+        if rows >= limit:
+          break
+        tables.append(read(add))
+        rows += tables[-1].num_rows
+      return tables
+    with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+      return list(pool.map(read, files))
+
+  # The rows matching `filters` and `where`, as an Arrow table of `columns` (all columns when None)
+  def scan(self, columns=None, filters=None, where=None, limit=None):
+    columns = self.columns if columns is None else list(columns)
+    result = self._concat(self._scan_files(columns, filters, where, limit), columns)
+    return result if limit is None else result.slice(0, limit)
+
+  # Concatenate per-file tables. Primitive columns already have the snapshot's types; a nested column missing from some
+  # files is null-typed there and takes the type the other files store it with.
+  def _concat(self, tables, columns):
+    types = {}
+    for c in columns:
+      types[c] = _arrow_type(self.fields[c]) or next((t.schema.field(c).type for t in tables if t.schema.field(c).type != pa.null()),
+                                                     pa.null())
+    if not tables:
+      return pa.Table.from_arrays([pa.array([], type=types[c]) for c in columns], names=columns)
+    schema = pa.schema([(c, types[c]) for c in columns])
+    return pa.concat_tables([t if t.schema == schema else
+                             pa.Table.from_arrays([t.column(c) if t.schema.field(c).type == types[c] else pa.nulls(t.num_rows, types[c])
+                                                   for c in columns], schema=schema)
+                             for t in tables])
+
+  # SELECT count(*) ... WHERE filters AND where
+  def count(self, filters=None, where=None):
+    if where is None:
+      return self.aggregate([("*", "count")], filters=filters).column("count_all")[0].as_py()
+    return builtins.sum(t.num_rows for t in self._scan_files([], filters, where))
+
+  # SELECT group_by..., aggregates... WHERE filters AND where GROUP BY group_by, as an Arrow table.
+  # `aggregations` are (column, function) pairs of pyarrow's Table.group_by().aggregate(), e.g. ("funded_amnt", "sum");
+  # ("*", "count") counts rows. Result columns are named like "funded_amnt_sum" and "count_all".
+  # count, min and max grouped by partition columns (or not grouped) are answered from the file stats where they can be,
+  # see _stats_plan; use_stats=False always scans.
+  def aggregate(self, aggregations, group_by=None, filters=None, where=None, use_stats=True):
+    group_by = list(group_by or [])
+    aggregations = _aggregate_specs(aggregations)
+    names = [_aggregate_name(column, function) for column, function in aggregations]
+    if use_stats and where is None and self._stats_answerable(aggregations, group_by):
+      from_stats, to_scan, _ = self._stats_plan(aggregations, filters)
+      return self._aggregate_from_stats(aggregations, group_by, filters, from_stats, to_scan)
+    columns = list(dict.fromkeys(group_by + [c for c, _ in aggregations if c != []]))
+    data = self.scan(columns, filters, where) if columns else \
+           pa.table({"__rows": pa.nulls(builtins.sum(t.num_rows for t in self._scan_files([], filters, where)), type=pa.bool_())})
+    return data.group_by(group_by).aggregate(aggregations).select(group_by + names)
+
+  # Whether the query shape allows answers from stats: only count, min and max, grouped by partition columns at most
+  def _stats_answerable(self, aggregations, group_by):
+    return (all(c in self.partition_columns for c in group_by) and
+            all(f in _STATS_AGGREGATES and (c == [] or c in self.fields) for c, f in aggregations))
+
+  # Split the candidate files of `filters` into those answered from their stats and those that must be scanned.
+  # A file is answered from stats when the stats prove that all of its rows match the filters and hold exact
+  # values for every aggregation. Returns (from_stats, to_scan, skipped) lists of AddFiles.
+  def _stats_plan(self, aggregations, filters):
+    index = self.skipping_index
+    may_match = index.mask(filters)
+    all_match = index.all_rows_mask(filters) & may_match
+    num_records = index.num_records.to_pylist()
+    answerable = np.array([r is not None for r in num_records], dtype=bool)
+    for column, function in aggregations:
+      if column == [] or column in self.partition_columns:
+        continue
+      stats = index.columns.get(column)
+      if stats is None or (function != "count" and stats.delta_type not in _EXACT_STATS_TYPES):
+        answerable[:] = False
+        break
+      null_counts = stats.null_counts.to_pylist()
+      if function == "count":
+        answerable &= np.array([n is not None for n in null_counts], dtype=bool)
+        continue
+      values = (stats.min_values if function == "min" else stats.max_values).to_pylist()
+      # A column that is null in every row has no min/max; otherwise it must be known and not a truncated string
+      answerable &= np.array([n is not None and r is not None and
+                              (n == r or (v is not None and not (isinstance(v, str) and len(v) >= self.string_prefix_length)))
+                              for v, n, r in zip(values, null_counts, num_records)], dtype=bool)
+    from_stats = [index.files[i] for i in np.flatnonzero(all_match & answerable)]
+    to_scan = [index.files[i] for i in np.flatnonzero(may_match & ~(all_match & answerable))]
+    skipped = [index.files[i] for i in np.flatnonzero(~may_match)]
+    return from_stats, to_scan, skipped
+
+  def _aggregate_from_stats(self, aggregations, group_by, filters, from_stats, to_scan):
+    index = self.skipping_index
+    position = {id(a): i for i, a in enumerate(index.files)}
+    names = [_aggregate_name(column, function) for column, function in aggregations]
+    types = [pa.int64() if f in ("count", "count_all") else _arrow_type(self.fields[c]) for c, f in aggregations]
+    group_types = [_arrow_type(self.fields[c]) or pa.string() for c in group_by]
+
+    # One partial row per file answered from stats
+    rows = {name: [] for name in group_by + names}
+    for add in from_stats:
+      i = position[id(add)]
+      records = index.num_records[i].as_py()
+      for c in group_by:
+        rows[c].append(_typed_value(self.fields[c], add.partition_values.get(c)))
+      for (column, function), name in zip(aggregations, names):
+        if function == "count_all":
+          value = records
+        elif column in self.partition_columns:
+          partition_value = _typed_value(self.fields[column], add.partition_values.get(column))
+          value = (0 if partition_value is None else records) if function == "count" else partition_value
+        elif function == "count":
+          value = records - index.columns[column].null_counts[i].as_py()
+        else:
+          stats = index.columns[column]
+          value = (stats.min_values if function == "min" else stats.max_values)[i].as_py()
+        rows[name].append(value)
+    partials = [pa.Table.from_arrays([pa.array(rows[n], type=t) for n, t in zip(group_by + names, group_types + types)],
+                                     names=group_by + names)]
+
+    # Partial rows of the files that are scanned
+    columns = list(dict.fromkeys(group_by + [c for c, _ in aggregations if c != []]))
+    tables = self._scan_files(columns, filters, None, files=to_scan) if to_scan else []
+    if tables:
+      data = (self._concat(tables, columns) if columns else
+              pa.table({"__rows": pa.nulls(builtins.sum(t.num_rows for t in tables), type=pa.bool_())}))
+      scanned = data.group_by(group_by).aggregate(aggregations).select(group_by + names)
+      partials.append(scanned.cast(partials[0].schema))
+
+    # Counts add up, minimums and maximums combine
+    combine = [(name, "sum" if function in ("count", "count_all") else function) for (_, function), name in zip(aggregations, names)]
+    result = pa.concat_tables(partials).group_by(group_by).aggregate(combine)
+    result = pa.Table.from_arrays([result.column(c) for c in group_by] +
+                                  [result.column("%s_%s" % (name, f)) for name, f in combine], names=group_by + names)
+    if not group_by:
+      # Like SQL, an ungrouped count of no rows is 0
+      result = pa.Table.from_arrays([pc.fill_null(result.column(n), 0) if f in ("count", "count_all") else result.column(n)
+                                     for n, (_, f) in zip(names, aggregations)], names=names)
+    return result
+
+  # How an aggregate would be answered, e.g. "12 files from stats, 2 scanned, 7 skipped"
+  def explain_aggregate(self, aggregations, group_by=None, filters=None, where=None):
+    aggregations = _aggregate_specs(aggregations)
+    if where is not None or not self._stats_answerable(aggregations, list(group_by or [])):
+      scanned = len(self.files(filters))
+      return "%d files scanned, %d skipped" % (scanned, self.snapshot.num_files - scanned)
+    from_stats, to_scan, skipped = self._stats_plan(aggregations, filters)
+    return "%d files from stats, %d scanned, %d skipped" % (len(from_stats), len(to_scan), len(skipped))
@@ -0,0 +1,116 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Log Diff
+# MAGIC
+# MAGIC What changed in a Delta table between two versions, computed from the transaction log alone:
+# MAGIC the net files added and removed, the bytes and records they hold, and every `metaData` (schema) or `protocol` change in between.
+# MAGIC
+# MAGIC The commits in the range are read on a thread pool, so a day of streaming commits is one call instead of one `spark.read.json` per commit.
+# MAGIC
+# MAGIC Usage:
+# MAGIC
+# MAGIC ```
+# MAGIC %run ./Includes/Delta-Log-Diff
+# MAGIC
+# MAGIC diff = diff_versions(delta_path, c_before, c_after)
+# MAGIC print(diff.summary())
+# MAGIC ```
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Snapshot
+
+# COMMAND ----------
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+@dataclass
+class VersionDiff:
+  start_version: int
+  end_version: int
+  added: Dict[str, AddFile] = field(default_factory=dict)          # files in end_version that were not in start_version
+  removed: Dict[str, RemoveFile] = field(default_factory=dict)     # files in start_version that are gone in end_version
+  bytes_added: int = 0
+  bytes_removed: int = 0
+  records_added: int = 0
+  records_removed: int = 0
+  files_without_stats: int = 0                                     # files whose records could not be counted from add.stats
+  metadata_changes: List[Tuple[int, Metadata]] = field(default_factory=list)
+  schema_changes: List[int] = field(default_factory=list)          # versions whose metaData changed the schema
+  protocol_changes: List[Tuple[int, Protocol]] = field(default_factory=list)
+  operations: List[Tuple[int, Optional[str]]] = field(default_factory=list)
+
+  @property
+  def net_bytes(self):
+    return self.bytes_added - self.bytes_removed
+
+  @property
+  def net_records(self):
+    return self.records_added - self.records_removed
+
+  def summary(self):
+    return ("Versions %d -> %d: +%d / -%d files, %+d bytes, %+d records, %d schema change(s) at %s"
+            % (self.start_version, self.end_version, len(self.added), len(self.removed),
+               self.net_bytes, self.net_records, len(self.schema_changes), self.schema_changes))
+
+# COMMAND ----------
+
+# Net effect of the commits start_version + 1 .. end_version (the latest version when None).
+# Remove actions carry no stats, so the record count of a removed file (and its size, when the remove has none) is taken from
+# the snapshot at start_version. That snapshot is loaded once a file was removed or a metaData action needs the schema it replaced.
+def diff_versions(table_path, start_version, end_version=None, max_workers=8):
+  commits = read_commits(table_path, start_version + 1, end_version, max_workers=max_workers)
+  if end_version is None:
+    end_version = commits[-1].version if commits else start_version
+  if end_version < start_version:
+    raise ValueError("end_version %d is before start_version %d" % (end_version, start_version))
+  if len(commits) != end_version - start_version:
+    raise ValueError("Commits %d..%d are not all present in the _delta_log" % (start_version + 1, end_version))
+
+  diff = VersionDiff(start_version=start_version, end_version=end_version)
+  base = {}
+
+  def base_snapshot():
+    if "snapshot" not in base:
+      base["snapshot"] = load_snapshot(table_path, start_version)
+    return base["snapshot"]
+
+  previous_schema = None
+  for commit in commits:
+    diff.operations.append((commit.version, commit.operation))
+    if commit.protocol is not None:
+      diff.protocol_changes.append((commit.version, commit.protocol))
+    if commit.metadata is not None:
+      diff.metadata_changes.append((commit.version, commit.metadata))
+      if previous_schema is None:
+        previous_metadata = base_snapshot().metadata if start_version >= 0 else None
+        previous_schema = previous_metadata.schema_string if previous_metadata else None
+      if commit.metadata.schema_string != previous_schema:
+        diff.schema_changes.append(commit.version)
+      previous_schema = commit.metadata.schema_string
+    for remove in commit.removes:
+      if diff.added.pop(remove.path, None) is None:
+        diff.removed[remove.path] = remove
+    for add in commit.adds:
+      if diff.removed.pop(add.path, None) is None:
+        diff.added[add.path] = add
+
+  for add in diff.added.values():
+    diff.bytes_added += add.size
+    records = add.num_records
+    if records is None:
+      diff.files_without_stats += 1
+    else:
+      diff.records_added += records
+
+  for remove in diff.removed.values():
+    original = base_snapshot().files.get(remove.path)
+    diff.bytes_removed += remove.size if remove.size is not None else (original.size if original else 0)
+    records = original.num_records if original else None
+    if records is None:
+      diff.files_without_stats += 1
+    else:
+      diff.records_removed += records
+
+  return diff
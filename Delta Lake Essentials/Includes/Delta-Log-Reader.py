@@ -0,0 +1,348 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Log Reader
+# MAGIC
+# MAGIC Pure-Python helpers for reading the `_delta_log` of a Delta table without starting a Spark job.
+# MAGIC
+# MAGIC Each commit file (`00000000000000000004.json`) is newline-delimited JSON where every line holds exactly one action:
+# MAGIC `add`, `remove`, `metaData`, `protocol`, `commitInfo` or `txn`. Instead of `spark.read.json(...)` (one job plus schema inference per file)
+# MAGIC these helpers stream the lines with plain file IO and parse them into small typed objects.
+# MAGIC
+# MAGIC Usage:
+# MAGIC
+# MAGIC ```
+# MAGIC %run ./Includes/Delta-Log-Reader
+# MAGIC
+# MAGIC commit = read_commit(deltaPath, 4)
+# MAGIC [a.path for a in commit.adds]
+# MAGIC
+# MAGIC for commit in iter_commits(deltaPath, start_version=0, end_version=10):
+# MAGIC   print(commit.version, commit.operation, len(commit.adds), len(commit.removes))
+# MAGIC ```
+
+# COMMAND ----------
+
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from urllib.parse import unquote
+
+DELTA_LOG_DIR = "_delta_log"
+LAST_CHECKPOINT_FILE = "_last_checkpoint"
+
+_COMMIT_FILE_RE = re.compile(r"^(\d{20})\.json$")
+
+# Paths in the notebooks are DBFS paths ("/tmp/loans_delta" or "dbfs:/tmp/loans_delta").
+# Plain Python file IO on a cluster has to go through the FUSE mount under /dbfs.
+def to_local_path(path):
+  if path.startswith("dbfs:"):
+    path = path[len("dbfs:"):]
+  if path.startswith("/dbfs/") or not os.path.isdir("/dbfs") or os.path.exists(path):
+    return path
+  return "/dbfs" + path
+
+# Local path of a data file referenced by add.path / remove.path. Relative paths are URL-encoded and relative to the table root.
+def data_file_path(table_path, path):
+  if "://" in path or path.startswith("dbfs:"):
+    return to_local_path("/" + path.split(":", 1)[1].lstrip("/"))
+  if path.startswith("/"):
+    return to_local_path(path)
+  return os.path.join(to_local_path(table_path), unquote(path))
+
+def delta_log_path(table_path):
+  return os.path.join(to_local_path(table_path), DELTA_LOG_DIR)
+
+def commit_file_path(table_path, version):
+  return os.path.join(delta_log_path(table_path), "%020d.json" % version)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Actions
+# MAGIC
+# MAGIC One class per action type. Field names follow the Delta protocol (`modificationTime` becomes `modification_time`, and so on).
+# MAGIC `stats` and `schema_string` are kept as raw JSON strings and only parsed when asked for.
+
+# COMMAND ----------
+
+@dataclass
+class AddFile:
+  path: str
+  size: int = 0
+  partition_values: Dict[str, Optional[str]] = field(default_factory=dict)
+  modification_time: int = 0
+  data_change: bool = True
+  stats: Optional[str] = None
+  tags: Optional[Dict[str, str]] = None
+
+  # Parsed add.stats ({"numRecords": .., "minValues": .., "maxValues": .., "nullCount": ..}), or None if the writer did not collect stats
+  def parsed_stats(self):
+    return json.loads(self.stats) if self.stats else None
+
+  @property
+  def num_records(self):
+    stats = self.parsed_stats()
+    return None if stats is None else stats.get("numRecords")
+
+@dataclass
+class RemoveFile:
+  path: str
+  deletion_timestamp: Optional[int] = None
+  data_change: bool = True
+  extended_file_metadata: bool = False
+  partition_values: Optional[Dict[str, Optional[str]]] = None
+  size: Optional[int] = None
+
+@dataclass
+class Metadata:
+  id: str
+  schema_string: str
+  partition_columns: List[str] = field(default_factory=list)
+  configuration: Dict[str, str] = field(default_factory=dict)
+  name: Optional[str] = None
+  description: Optional[str] = None
+  format_provider: str = "parquet"
+  created_time: Optional[int] = None
+
+  @property
+  def schema(self):
+    return json.loads(self.schema_string)
+
+@dataclass
+class Protocol:
+  min_reader_version: int
+  min_writer_version: int
+
+@dataclass
+class CommitInfo:
+  timestamp: Optional[int] = None
+  operation: Optional[str] = None
+  operation_parameters: Dict[str, object] = field(default_factory=dict)
+  operation_metrics: Dict[str, object] = field(default_factory=dict)
+  read_version: Optional[int] = None
+  is_blind_append: Optional[bool] = None
+  user_metadata: Optional[str] = None
+
+@dataclass
+class SetTransaction:
+  app_id: str
+  version: int
+  last_updated: Optional[int] = None
+
+def _parse_add(a):
+  return AddFile(path=a["path"],
+                 size=a.get("size") or 0,
+                 partition_values=a.get("partitionValues") or {},
+                 modification_time=a.get("modificationTime") or 0,
+                 data_change=a.get("dataChange", True),
+                 stats=a.get("stats"),
+                 tags=a.get("tags"))
+
+def _parse_remove(r):
+  return RemoveFile(path=r["path"],
+                    deletion_timestamp=r.get("deletionTimestamp"),
+                    data_change=r.get("dataChange", True),
+                    extended_file_metadata=r.get("extendedFileMetadata") or False,
+                    partition_values=r.get("partitionValues"),
+                    size=r.get("size"))
+
+def _parse_metadata(m):
+  return Metadata(id=m["id"],
+                  schema_string=m["schemaString"],
+                  partition_columns=m.get("partitionColumns") or [],
+                  configuration=m.get("configuration") or {},
+                  name=m.get("name"),
+                  description=m.get("description"),
+                  format_provider=(m.get("format") or {}).get("provider", "parquet"),
+                  created_time=m.get("createdTime"))
+
+def _parse_protocol(p):
+  return Protocol(min_reader_version=p["minReaderVersion"], min_writer_version=p["minWriterVersion"])
+
+def _parse_commit_info(c):
+  return CommitInfo(timestamp=c.get("timestamp"),
+                    operation=c.get("operation"),
+                    operation_parameters=c.get("operationParameters") or {},
+                    operation_metrics=c.get("operationMetrics") or {},
+                    read_version=c.get("readVersion"),
+                    is_blind_append=c.get("isBlindAppend"),
+                    user_metadata=c.get("userMetadata"))
+
+def _parse_txn(t):
+  return SetTransaction(app_id=t["appId"], version=t["version"], last_updated=t.get("lastUpdated"))
+
+_ACTION_PARSERS = {
+  "add": _parse_add,
+  "remove": _parse_remove,
+  "metaData": _parse_metadata,
+  "protocol": _parse_protocol,
+  "commitInfo": _parse_commit_info,
+  "txn": _parse_txn,
+}
+
+# Turn one decoded log line into a typed action. Action types we do not model (cdc, domainMetadata, ...) return None.
+def parse_action(obj):
+  for key, value in obj.items():
+    parser = _ACTION_PARSERS.get(key)
+    if parser is not None and value is not None:
+      return parser(value)
+  return None
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Commits
+
+# COMMAND ----------
+
+@dataclass
+class Commit:
+  version: int
+  adds: List[AddFile] = field(default_factory=list)
+  removes: List[RemoveFile] = field(default_factory=list)
+  metadata: Optional[Metadata] = None
+  protocol: Optional[Protocol] = None
+  commit_info: Optional[CommitInfo] = None
+  txns: List[SetTransaction] = field(default_factory=list)
+
+  @property
+  def timestamp(self):
+    return self.commit_info.timestamp if self.commit_info else None
+
+  @property
+  def operation(self):
+    return self.commit_info.operation if self.commit_info else None
+
+  def add_action(self, action):
+    if isinstance(action, AddFile):
+      self.adds.append(action)
+    elif isinstance(action, RemoveFile):
+      self.removes.append(action)
+    elif isinstance(action, Metadata):
+      self.metadata = action
+    elif isinstance(action, Protocol):
+      self.protocol = action
+    elif isinstance(action, CommitInfo):
+      self.commit_info = action
+    elif isinstance(action, SetTransaction):
+      self.txns.append(action)
+
+# Stream the actions of one commit file, one line at a time
+def iter_actions(file_path):
+  with open(file_path, "r", encoding="utf-8") as f:
+    for line in f:
+      line = line.strip()
+      if not line:
+        continue
+      action = parse_action(json.loads(line))
+      if action is not None:
+        yield action
+
+def read_commit(table_path, version):
+  commit = Commit(version=version)
+  for action in iter_actions(commit_file_path(table_path, version)):
+    commit.add_action(action)
+  return commit
+
+# Sorted commit versions present in _delta_log, optionally restricted to [start_version, end_version]
+def list_commit_versions(table_path, start_version=0, end_version=None):
+  versions = []
+  with os.scandir(delta_log_path(table_path)) as entries:
+    for entry in entries:
+      m = _COMMIT_FILE_RE.match(entry.name)
+      if m is None:
+        continue
+      version = int(m.group(1))
+      if version >= start_version and (end_version is None or version <= end_version):
+        versions.append(version)
+  versions.sort()
+  return versions
+
+# Lazily yield every commit in [start_version, end_version] in order. Only one commit is held in memory at a time.
+def iter_commits(table_path, start_version=0, end_version=None):
+  expected = None
+  for version in list_commit_versions(table_path, start_version, end_version):
+    if expected is not None and version != expected:
+      raise ValueError("Delta log is missing commit %d (found %d next)" % (expected, version))
+    yield read_commit(table_path, version)
+    expected = version + 1
+
+# Read every commit in [start_version, end_version] on a thread pool, returned in version order.
+# Commit files are small and reading them is IO bound, so long ranges are mostly waiting on storage latency.
+def read_commits(table_path, start_version=0, end_version=None, max_workers=8):
+  versions = list_commit_versions(table_path, start_version, end_version)
+  for previous, version in zip(versions, versions[1:]):
+    if version != previous + 1:
+      raise ValueError("Delta log is missing commit %d (found %d next)" % (previous + 1, version))
+  if len(versions) <= 1 or max_workers <= 1:
+    return [read_commit(table_path, v) for v in versions]
+  with ThreadPoolExecutor(max_workers=max_workers) as pool:
+    return list(pool.map(lambda v: read_commit(table_path, v), versions))
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Latest version
+# MAGIC
+# MAGIC `deltaTable.history(1)` and `DESCRIBE HISTORY ... LIMIT 1` both run a Spark job to answer "what is the current version?".
+# MAGIC Commit files are contiguous, so the answer can be found by starting at the version recorded in `_last_checkpoint`
+# MAGIC and probing forward with a galloping search: a handful of file-existence checks and no directory listing.
+
+# COMMAND ----------
+
+@dataclass
+class VersionInfo:
+  version: int
+  timestamp: Optional[int]   # commitInfo.timestamp in epoch milliseconds (commit file mtime when commitInfo is missing)
+
+# Contents of _delta_log/_last_checkpoint ({"version": 10, "size": 13, "parts": 2, ...}), or None when the table has never been checkpointed
+def read_last_checkpoint(table_path):
+  try:
+    with open(os.path.join(delta_log_path(table_path), LAST_CHECKPOINT_FILE), "r", encoding="utf-8") as f:
+      return json.loads(f.read())
+  except FileNotFoundError:
+    return None
+
+def _commit_exists(table_path, version):
+  return os.path.exists(commit_file_path(table_path, version))
+
+def latest_version(table_path):
+  last = read_last_checkpoint(table_path)
+  low = last["version"] if last is not None else 0
+  if not _commit_exists(table_path, low):
+    # Stale _last_checkpoint or a log whose early commits were cleaned up without a checkpoint: fall back to a listing
+    versions = list_commit_versions(table_path)
+    if not versions:
+      raise FileNotFoundError("No commits found in %s" % delta_log_path(table_path))
+    return versions[-1]
+  # Gallop forward until a missing commit is found, then binary search between the last hit and the first miss
+  step = 1
+  while _commit_exists(table_path, low + step):
+    low += step
+    step *= 2
+  high = low + step
+  while high - low > 1:
+    middle = (low + high) // 2
+    if _commit_exists(table_path, middle):
+      low = middle
+    else:
+      high = middle
+  return low
+
+def commit_timestamp(table_path, version):
+  file_path = commit_file_path(table_path, version)
+  with open(file_path, "r", encoding="utf-8") as f:
+    for line in f:
+      if '"commitInfo"' not in line:
+        continue
+      action = parse_action(json.loads(line))
+      if isinstance(action, CommitInfo) and action.timestamp is not None:
+        return action.timestamp
+  return int(os.path.getmtime(file_path) * 1000)
+
+def latest_version_info(table_path):
+  version = latest_version(table_path)
+  return VersionInfo(version=version, timestamp=commit_timestamp(table_path, version))
@@ -0,0 +1,89 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Log Tailer
+# MAGIC
+# MAGIC Follows a table's `_delta_log` and hands every new commit, already parsed, to a callback or an async iterator.
+# MAGIC
+# MAGIC The tailer remembers the last version it has seen and only probes for the next commit file (`N + 1.json`, `N + 2.json`, ...),
+# MAGIC so each poll costs one file-existence check plus one read per new commit instead of a full `ls` of `_delta_log`.
+# MAGIC
+# MAGIC Usage:
+# MAGIC
+# MAGIC ```
+# MAGIC %run ./Includes/Delta-Log-Tailer
+# MAGIC
+# MAGIC tailer = DeltaLogTailer(delta_path)
+# MAGIC
+# MAGIC # Blocking, with a callback
+# MAGIC tailer.follow(lambda c: print(c.version, c.operation, len(c.adds)), interval=5, timeout=60)
+# MAGIC
+# MAGIC # Or from async code
+# MAGIC async for commit in tailer:
+# MAGIC   print(commit.version, commit.operation)
+# MAGIC ```
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Log-Reader
+
+# COMMAND ----------
+
+import asyncio
+import os
+import threading
+import time
+
+class DeltaLogTailer:
+
+  # start_version is the first version to report. By default only commits written after the tailer is created are reported.
+  def __init__(self, table_path, start_version=None):
+    self.table_path = table_path
+    if start_version is None:
+      start_version = latest_version(table_path) + 1 if os.path.isdir(delta_log_path(table_path)) else 0
+    self.last_version = start_version - 1
+    self._stop = threading.Event()
+
+  def __repr__(self):
+    return "DeltaLogTailer(%s, last_version=%d)" % (self.table_path, self.last_version)
+
+  # Read every commit written since the previous poll, oldest first
+  def poll(self):
+    commits = []
+    while os.path.exists(commit_file_path(self.table_path, self.last_version + 1)):
+      commits.append(read_commit(self.table_path, self.last_version + 1))
+      self.last_version += 1
+    return commits
+
+  # Call `callback(commit)` for each new commit until stop() is called or `timeout` seconds have passed
+  def follow(self, callback, interval=1.0, timeout=None):
+    self._stop.clear()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while not self._stop.is_set():
+      for commit in self.poll():
+        callback(commit)
+      if deadline is not None and time.monotonic() >= deadline:
+        break
+      self._stop.wait(interval)
+
+  # Run follow() on a daemon thread, e.g. to invalidate a cache while the notebook keeps running
+  def follow_in_background(self, callback, interval=1.0):
+    thread = threading.Thread(target=self.follow, args=(callback, interval), daemon=True)
+    thread.start()
+    return thread
+
+  def stop(self):
+    self._stop.set()
+
+  # Async generator over new commits; the file IO runs on the default executor so the event loop is never blocked
+  async def commits(self, interval=1.0):
+    self._stop.clear()
+    loop = asyncio.get_running_loop()
+    while not self._stop.is_set():
+      new_commits = await loop.run_in_executor(None, self.poll)
+      for commit in new_commits:
+        yield commit
+      if not new_commits:
+        await asyncio.sleep(interval)
+
+  def __aiter__(self):
+    return self.commits()
@@ -0,0 +1,200 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Log Writer
+# MAGIC
+# MAGIC The write side of `./Delta-Log-Reader`: write Parquet data files with their `add.stats`, and commit a list of actions as the next version of the table.
+# MAGIC
+# MAGIC A commit is the atomic creation of `_delta_log/000...N.json`. The file is created with exclusive-create (`open(..., "x")`),
+# MAGIC so if another writer already committed version N the commit fails with `ConcurrentCommitError` instead of overwriting it.
+# MAGIC This is put-if-absent on a local or FUSE-mounted file system; object stores need a Delta LogStore for the same guarantee.
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Log-Reader
+
+# COMMAND ----------
+
+import datetime
+import decimal
+import json
+import math
+import os
+import time
+import uuid
+from dataclasses import replace
+from urllib.parse import quote
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+class ConcurrentCommitError(Exception):
+  def __init__(self, table_path, version):
+    super().__init__("Version %d of %s was already committed by another writer" % (version, table_path))
+    self.table_path = table_path
+    self.version = version
+
+def now_millis():
+  return int(time.time() * 1000)
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Serializing actions
+
+# COMMAND ----------
+
+def _drop_none(d):
+  return {k: v for k, v in d.items() if v is not None}
+
+def action_to_dict(action):
+  if isinstance(action, AddFile):
+    return {"add": _drop_none({"path": action.path, "partitionValues": action.partition_values, "size": action.size,
+                               "modificationTime": action.modification_time, "dataChange": action.data_change,
+                               "stats": action.stats, "tags": action.tags})}
+  if isinstance(action, RemoveFile):
+    return {"remove": _drop_none({"path": action.path, "deletionTimestamp": action.deletion_timestamp,
+                                  "dataChange": action.data_change, "extendedFileMetadata": action.extended_file_metadata,
+                                  "partitionValues": action.partition_values, "size": action.size})}
+  if isinstance(action, Metadata):
+    return {"metaData": _drop_none({"id": action.id, "name": action.name, "description": action.description,
+                                    "format": {"provider": action.format_provider, "options": {}},
+                                    "schemaString": action.schema_string, "partitionColumns": action.partition_columns,
+                                    "configuration": action.configuration, "createdTime": action.created_time})}
+  if isinstance(action, Protocol):
+    return {"protocol": {"minReaderVersion": action.min_reader_version, "minWriterVersion": action.min_writer_version}}
+  if isinstance(action, CommitInfo):
+    return {"commitInfo": _drop_none({"timestamp": action.timestamp, "operation": action.operation,
+                                      "operationParameters": action.operation_parameters,
+                                      "operationMetrics": action.operation_metrics, "readVersion": action.read_version,
+                                      "isBlindAppend": action.is_blind_append, "userMetadata": action.user_metadata})}
+  if isinstance(action, SetTransaction):
+    return {"txn": _drop_none({"appId": action.app_id, "version": action.version, "lastUpdated": action.last_updated})}
+  raise TypeError("Not a Delta action: %r" % (action,))
+
+# The opposite of an AddFile: the remove action that takes it out of the table
+def remove_for(add, deletion_timestamp=None, data_change=True):
+  return RemoveFile(path=add.path,
+                    deletion_timestamp=deletion_timestamp or now_millis(),
+                    data_change=data_change,
+                    extended_file_metadata=True,
+                    partition_values=add.partition_values,
+                    size=add.size)
+
+# Atomically write `actions` as `version`. commitInfo is written first, as Spark does.
+def write_commit(table_path, version, actions):
+  actions = sorted(actions, key=lambda a: 0 if isinstance(a, CommitInfo) else 1)
+  body = "\n".join(json.dumps(action_to_dict(a), separators=(",", ":")) for a in actions) + "\n"
+  os.makedirs(delta_log_path(table_path), exist_ok=True)
+  try:
+    with open(commit_file_path(table_path, version), "x", encoding="utf-8") as f:
+      f.write(body)
+  except FileExistsError:
+    raise ConcurrentCommitError(table_path, version) from None
+  return version
+
+# Table features (reader version 3 / writer version 7) such as deletion vectors attach state to add actions that these writers
+# don't carry over, so a rearrange-only commit would silently drop it
+def check_writable(snapshot):
+  protocol = snapshot.protocol
+  if protocol is not None and (protocol.min_reader_version >= 3 or protocol.min_writer_version >= 7):
+    raise ValueError("%s uses table features; write to it with Delta" % snapshot.table_path)
+
+# Commit `properties` into the table configuration on top of `snapshot`, like ALTER TABLE ... SET TBLPROPERTIES.
+# Returns the version of that commit.
+def commit_table_properties(snapshot, properties, operation="SET TBLPROPERTIES"):
+  check_writable(snapshot)
+  configuration = dict(snapshot.metadata.configuration or {}, **properties)
+  commit_info = CommitInfo(timestamp=now_millis(),
+                           operation=operation,
+                           operation_parameters={"properties": json.dumps(properties)},
+                           read_version=snapshot.version,
+                           is_blind_append=False)
+  return write_commit(snapshot.table_path, snapshot.version + 1, [commit_info, replace(snapshot.metadata, configuration=configuration)])
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Writing data files
+
+# COMMAND ----------
+
+# Longest string kept in minValues; maxValues are dropped for longer strings since a truncated max would be too small
+STATS_STRING_PREFIX_LENGTH = 32
+
+# JSON value of a min (round_up=False) or max (round_up=True) statistic
+def _stats_value(value, round_up):
+  if isinstance(value, decimal.Decimal):
+    # Delta stores decimal stats as JSON numbers; the nearest float is widened so it still bounds the exact value
+    bound = float(value)
+    if (decimal.Decimal(bound) < value) if round_up else (decimal.Decimal(bound) > value):
+      bound = math.nextafter(bound, math.inf if round_up else -math.inf)
+    return bound
+  if isinstance(value, datetime.datetime):
+    if value.tzinfo is not None:
+      value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value.isoformat(timespec="milliseconds") + "Z"
+  if isinstance(value, (datetime.date, datetime.time)):
+    return value.isoformat()
+  if isinstance(value, bytes):
+    return None
+  return value
+
+# add.stats for an Arrow table: numRecords, plus minValues / maxValues / nullCount for its top-level primitive columns
+def compute_file_stats(table):
+  stats = {"numRecords": table.num_rows, "minValues": {}, "maxValues": {}, "nullCount": {}}
+  for name, column in zip(table.column_names, table.columns):
+    if pa.types.is_nested(column.type):
+      continue
+    stats["nullCount"][name] = column.null_count
+    if pa.types.is_boolean(column.type) or column.null_count == len(column):
+      continue
+    if getattr(pa.types, "is_string_view", lambda t: False)(column.type):
+      # Newer Arrow writers produce string_view columns, which min_max has no kernel for
+      column = column.cast(pa.large_string())
+    min_max = pc.min_max(column).as_py()
+    low, high = _stats_value(min_max["min"], round_up=False), _stats_value(min_max["max"], round_up=True)
+    if low is None or high is None:
+      continue
+    if isinstance(low, str):
+      low = low[:STATS_STRING_PREFIX_LENGTH]
+      if len(high) > STATS_STRING_PREFIX_LENGTH:
+        high = None
+    stats["minValues"][name] = low
+    if high is not None:
+      stats["maxValues"][name] = high
+  return json.dumps(stats, separators=(",", ":"))
+
+# Relative directory of a partition, e.g. "addr_state=CA", with values escaped the way Hive-style partition directories are
+def partition_dir(partition_columns, partition_values):
+  return "/".join("%s=%s" % (c, quote(partition_values.get(c) or "__HIVE_DEFAULT_PARTITION__", safe=""))
+                  for c in partition_columns)
+
+# Called as hook(table_path, add, table, metadata) after every data file written by write_data_file, e.g. to build sidecar indexes.
+# `metadata` is the Metadata the caller read the table with, or None when it passed none; hooks must not read the log per file.
+# Kept when this notebook is run again, so hooks registered by other notebooks survive a later %run.
+try:
+  DATA_FILE_WRITE_HOOKS
+except NameError:
+  DATA_FILE_WRITE_HOOKS = []
+
+# Write `table` (without its partition columns) as one new data file of the partition and return its AddFile, not yet committed.
+# `metadata` of the snapshot the write is based on is handed to the DATA_FILE_WRITE_HOOKS.
+def write_data_file(table_path, table, partition_columns=(), partition_values=None, data_change=True, metadata=None):
+  partition_values = partition_values or {}
+  name = "part-00000-%s-c000.snappy.parquet" % uuid.uuid4()
+  directory = partition_dir(partition_columns, partition_values)
+  relative_path = "%s/%s" % (directory, name) if directory else name
+  local_path = os.path.join(to_local_path(table_path), relative_path)
+  os.makedirs(os.path.dirname(local_path), exist_ok=True)
+  pq.write_table(table, local_path, compression="snappy")
+  # add.path is URL-encoded on top of the escaping already applied to the partition directory name
+  add = AddFile(path=quote(relative_path, safe="/="),
+                size=os.path.getsize(local_path),
+                partition_values={c: partition_values.get(c) for c in partition_columns},
+                modification_time=now_millis(),
+                data_change=data_change,
+                stats=compute_file_stats(table))
+  for hook in DATA_FILE_WRITE_HOOKS:
+    hook(table_path, add, table, metadata)
+  return add
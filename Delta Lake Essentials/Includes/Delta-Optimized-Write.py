@@ -0,0 +1,132 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Optimized Write
+# MAGIC
+# MAGIC `df.write.format("delta")` writes one file per task for every table partition that task holds rows for:
+# MAGIC 200 shuffle partitions spread over 4 states give up to 800 files per write, however few rows there are.
+# MAGIC `optimized_write` first counts the rows per table partition, works out how many files of about `target_file_size`
+# MAGIC each partition needs, and assigns every row to one of those files. It then range-partitions on that assignment before the Delta sink,
+# MAGIC so all rows of a file are written by the same task. Small partitions are coalesced into one file, large ones are split evenly.
+# MAGIC
+# MAGIC The size of a row on disk is taken from the table itself (bytes over `numRecords` of its current files);
+# MAGIC for a new table, or one without stats, pass `bytes_per_row`.
+# MAGIC
+# MAGIC Usage:
+# MAGIC
+# MAGIC ```
+# MAGIC %run ./Includes/Delta-Optimized-Write
+# MAGIC
+# MAGIC optimized_write(df, delta_path, target_file_size=128 * 1024 * 1024)
+# MAGIC
+# MAGIC # Streaming: one optimized, idempotent write per micro-batch
+# MAGIC stream_data.writeStream.foreachBatch(optimized_write_batch(delta_path, partition_by=["addr_state"])).start()
+# MAGIC ```
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Snapshot
+
+# COMMAND ----------
+
+import builtins
+import math
+import os
+
+from pyspark.sql import functions as F
+from pyspark.sql.types import LongType, StructField, StructType
+
+DEFAULT_OPTIMIZED_WRITE_FILE_SIZE = 128 * 1024 * 1024
+DEFAULT_BYTES_PER_ROW = 64
+_FILE_ID_COLUMN = "__optimized_write_file"
+
+# Average bytes per row of the table's current files, or None when the table doesn't exist or has no row counts
+def table_bytes_per_row(table_path):
+  if not os.path.isdir(delta_log_path(table_path)):
+    return None
+  snapshot = load_snapshot(table_path)
+  sized = [(a.size, a.num_records) for a in snapshot.files.values() if a.num_records]
+  if not sized:
+    return None
+  return builtins.sum(s for s, _ in sized) / builtins.sum(r for _, r in sized)
+
+# For {partition key: row count}: {partition key: (first file id, number of files)}, the file ids numbered 0..total-1
+def plan_write_files(partition_rows, bytes_per_row, target_file_size):
+  rows_per_file = builtins.max(1, int(target_file_size / bytes_per_row))
+  files, next_id = {}, 0
+  for key in sorted(partition_rows, key=lambda k: tuple("" if v is None else str(v) for v in k)):
+    num_files = builtins.max(1, math.ceil(partition_rows[key] / rows_per_file))
+    files[key] = (next_id, num_files)
+    next_id += num_files
+  return files
+
+# `df` with the file id of every row: the first file of its partition plus a hash of the row modulo the partition's file count.
+# The per-partition file ranges are broadcast-joined, so the plan stays small however many partitions the write touches.
+def _with_file_ids(df, partition_by, files):
+  row_hash = F.xxhash64(*[F.col(c) for c in df.columns])
+  if not partition_by:
+    first, num_files = files[()]
+    return df.withColumn(_FILE_ID_COLUMN, F.pmod(row_hash, F.lit(num_files)) + F.lit(first))
+  keys = ["__optimized_write_key_%d" % i for i in range(len(partition_by))]
+  schema = StructType([StructField(k, df.schema[c].dataType) for k, c in zip(keys, partition_by)] +
+                      [StructField("__optimized_write_first", LongType()), StructField("__optimized_write_files", LongType())])
+  ranges = df.sparkSession.createDataFrame([key + (first, num_files) for key, (first, num_files) in files.items()], schema)
+  condition = None
+  for k, c in zip(keys, partition_by):
+    match = df[c].eqNullSafe(ranges[k])
+    condition = match if condition is None else condition & match
+  return (df.join(F.broadcast(ranges), condition)
+            .withColumn(_FILE_ID_COLUMN, F.pmod(row_hash, F.col("__optimized_write_files")) + F.col("__optimized_write_first"))
+            .drop(*keys, "__optimized_write_first", "__optimized_write_files"))
+
+# Write `df` to the Delta table with about target_file_size bytes per file.
+# `options` are passed on to the writer, e.g. {"txnAppId": ..., "txnVersion": ...} or {"mergeSchema": True}.
+def optimized_write(df, table_path, partition_by=None, mode="append", target_file_size=DEFAULT_OPTIMIZED_WRITE_FILE_SIZE,
+                    bytes_per_row=None, options=None):
+  if partition_by is None:
+    partition_by = load_snapshot(table_path, with_stats=False).partition_columns if os.path.isdir(delta_log_path(table_path)) else []
+  partition_by = list(partition_by)
+  if bytes_per_row is None:
+    bytes_per_row = table_bytes_per_row(table_path) or DEFAULT_BYTES_PER_ROW
+  df = df.persist()
+  try:
+    if partition_by:
+      partition_rows = {tuple(r[c] for c in partition_by): r["count"] for r in df.groupBy(*partition_by).count().collect()}
+    else:
+      partition_rows = {(): df.count()}
+    if not any(partition_rows.values()):
+      # Nothing to write, e.g. an empty micro-batch
+      return
+    files = plan_write_files(partition_rows, bytes_per_row, target_file_size)
+    num_files = builtins.sum(n for _, n in files.values())
+    # Range partitioning keeps all rows of a file id in one task; a task may get several (small) files, never part of one
+    writer = (_with_file_ids(df, partition_by, files)
+                .repartitionByRange(num_files, _FILE_ID_COLUMN)
+                .drop(_FILE_ID_COLUMN)
+                .write
+                .format("delta")
+                .mode(mode))
+    for key, value in (options or {}).items():
+      writer = writer.option(key, value)
+    if partition_by:
+      writer = writer.partitionBy(*partition_by)
+    writer.save(table_path)
+  finally:
+    df.unpersist()
+
+# foreachBatch function for a streaming query. Every micro-batch is written with optimized_write and tagged with
+# txnAppId / txnVersion, so a batch replayed after a failure is skipped instead of written twice.
+# The partition columns and the row size are looked up once, at the first non-empty batch, instead of replaying the log every trigger.
+def optimized_write_batch(table_path, partition_by=None, target_file_size=DEFAULT_OPTIMIZED_WRITE_FILE_SIZE, bytes_per_row=None,
+                          app_id=None):
+  app_id = app_id or "optimized-write-%s" % os.path.basename(table_path.rstrip("/"))
+  table = {"partition_by": partition_by, "bytes_per_row": bytes_per_row}
+
+  def write_batch(batch_df, batch_id):
+    if os.path.isdir(delta_log_path(table_path)):
+      if table["partition_by"] is None:
+        table["partition_by"] = load_snapshot(table_path, with_stats=False).partition_columns
+      if table["bytes_per_row"] is None:
+        table["bytes_per_row"] = table_bytes_per_row(table_path)
+    optimized_write(batch_df, table_path, table["partition_by"], "append", target_file_size,
+                    table["bytes_per_row"] or DEFAULT_BYTES_PER_ROW, options={"txnAppId": app_id, "txnVersion": batch_id})
+  return write_batch
@@ -0,0 +1,119 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Schema History
+# MAGIC
+# MAGIC An index of every schema a Delta table has had, built from the `metaData` actions in its log.
+# MAGIC Each schema is parsed into a `StructType` once (`StructType.fromJson` is plain Python, no Spark job) and cached,
+# MAGIC so "schema at version N" is a binary search over the versions where the schema changed.
+# MAGIC
+# MAGIC Usage:
+# MAGIC
+# MAGIC ```
+# MAGIC %run ./Includes/Delta-Schema-History
+# MAGIC
+# MAGIC history = SchemaHistory(delta_path)
+# MAGIC history.schema_at(c_before)
+# MAGIC history.changed_versions()
+# MAGIC history.schema_changes()   # [(version, added columns, removed columns), ...]
+# MAGIC ```
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Checkpoint-Reader
+
+# COMMAND ----------
+
+import bisect
+import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from pyspark.sql.types import StructType
+
+@lru_cache(maxsize=256)
+def parse_schema_string(schema_string):
+  return StructType.fromJson(json.loads(schema_string))
+
+# The metaData action of one commit, or None. Only lines mentioning metaData are decoded, so large append commits stay cheap.
+def read_commit_metadata(table_path, version):
+  with open(commit_file_path(table_path, version), "r", encoding="utf-8") as f:
+    for line in f:
+      if '"metaData"' not in line:
+        continue
+      action = parse_action(json.loads(line))
+      if isinstance(action, Metadata):
+        return action
+  return None
+
+# COMMAND ----------
+
+class SchemaHistory:
+
+  def __init__(self, table_path, max_workers=8):
+    self.table_path = table_path
+    self.max_workers = max_workers
+    self.last_version = -1
+    self._versions = []   # versions whose metaData changed the schema, ascending
+    self._schemas = []    # schema string in effect from the matching version on
+    self.update()
+
+  def __repr__(self):
+    return "SchemaHistory(%s, last_version=%d, schemas from versions %s)" % (self.table_path, self.last_version, self._versions)
+
+  def _record(self, version, metadata):
+    if metadata is None:
+      return
+    if not self._schemas or self._schemas[-1] != metadata.schema_string:
+      self._versions.append(version)
+      self._schemas.append(metadata.schema_string)
+
+  # Index the commits written since the last call. Commits older than the log retention are covered by the checkpoint's metaData.
+  def update(self):
+    versions = list_commit_versions(self.table_path, self.last_version + 1)
+    if not versions:
+      return
+    if self.last_version < 0 and versions[0] > 0:
+      checkpoint_version = find_checkpoint_version(self.table_path, versions[0])
+      if checkpoint_version is None:
+        raise ValueError("Commits before version %d are gone and there is no checkpoint to recover the schema from" % versions[0])
+      for action in iter_checkpoint_actions(self.table_path, checkpoint_version, {"metaData": None}):
+        self._record(checkpoint_version, action)
+      self.last_version = checkpoint_version
+      versions = [v for v in versions if v > checkpoint_version]
+    with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+      for version, metadata in zip(versions, pool.map(lambda v: read_commit_metadata(self.table_path, v), versions)):
+        self._record(version, metadata)
+    if versions:
+      self.last_version = versions[-1]
+
+  def schema_string_at(self, version):
+    if version > self.last_version:
+      self.update()
+    i = bisect.bisect_right(self._versions, version) - 1
+    if i < 0 or version > self.last_version:
+      raise ValueError("No schema recorded for version %d of %s" % (version, self.table_path))
+    return self._schemas[i]
+
+  def schema_at(self, version):
+    return parse_schema_string(self.schema_string_at(version))
+
+  @property
+  def current_schema(self):
+    return self.schema_at(self.last_version)
+
+  # [(first version, last version or None while current, StructType)] for every schema the table has had
+  def ranges(self):
+    ends = [v - 1 for v in self._versions[1:]] + [None]
+    return [(start, end, parse_schema_string(s)) for start, end, s in zip(self._versions, ends, self._schemas)]
+
+  def changed_versions(self):
+    return list(self._versions[1:])
+
+  # [(version, added column names, removed column names)] for every schema change after the first schema
+  def schema_changes(self):
+    changes = []
+    for i in range(1, len(self._versions)):
+      before = set(parse_schema_string(self._schemas[i - 1]).fieldNames())
+      after = parse_schema_string(self._schemas[i]).fieldNames()
+      changes.append((self._versions[i], [c for c in after if c not in before], sorted(before - set(after))))
+    return changes
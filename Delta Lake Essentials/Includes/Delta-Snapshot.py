@@ -0,0 +1,129 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Snapshot
+# MAGIC
+# MAGIC Rebuilds the state of a Delta table at a given version without Spark: load the newest checkpoint, replay the JSON commits after it,
+# MAGIC and keep the active files and tombstones in dictionaries keyed by path.
+# MAGIC
+# MAGIC A `Snapshot` can be rolled forward with `update()`, so moving from version N to N + k only reads the k new commits.
+# MAGIC
+# MAGIC Usage:
+# MAGIC
+# MAGIC ```
+# MAGIC %run ./Includes/Delta-Snapshot
+# MAGIC
+# MAGIC snapshot = load_snapshot(deltaPath, version=10)
+# MAGIC snapshot.num_files, snapshot.size_in_bytes
+# MAGIC sorted(snapshot.files)
+# MAGIC ```
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Checkpoint-Reader
+
+# COMMAND ----------
+
+# The includes run in the notebook's namespace, where `from pyspark.sql.functions import *` shadows sum, max, min and round
+import builtins
+import re
+
+import pyarrow as pa
+
+class Snapshot:
+
+  def __init__(self, table_path):
+    self.table_path = table_path
+    self.version = -1
+    self.metadata = None
+    self.protocol = None
+    self.files = {}        # path -> AddFile for every file in the table at self.version
+    self.tombstones = {}   # path -> RemoveFile for files removed but not yet vacuumed
+    self.txns = {}         # appId -> SetTransaction (streaming writers' progress)
+
+  def __repr__(self):
+    return "Snapshot(%s, version=%d, files=%d)" % (self.table_path, self.version, len(self.files))
+
+  @property
+  def num_files(self):
+    return len(self.files)
+
+  @property
+  def size_in_bytes(self):
+    return builtins.sum(a.size for a in self.files.values())
+
+  @property
+  def partition_columns(self):
+    return self.metadata.partition_columns if self.metadata else []
+
+  def apply_action(self, action):
+    if isinstance(action, AddFile):
+      self.files[action.path] = action
+      self.tombstones.pop(action.path, None)
+    elif isinstance(action, RemoveFile):
+      self.files.pop(action.path, None)
+      self.tombstones[action.path] = action
+    elif isinstance(action, Metadata):
+      self.metadata = action
+    elif isinstance(action, Protocol):
+      self.protocol = action
+    elif isinstance(action, SetTransaction):
+      self.txns[action.app_id] = action
+
+  def apply_commit(self, commit):
+    if commit.version != self.version + 1:
+      raise ValueError("Cannot apply commit %d on top of version %d" % (commit.version, self.version))
+    if commit.protocol is not None:
+      self.protocol = commit.protocol
+    if commit.metadata is not None:
+      self.metadata = commit.metadata
+    for txn in commit.txns:
+      self.txns[txn.app_id] = txn
+    for remove in commit.removes:
+      self.apply_action(remove)
+    for add in commit.adds:
+      self.apply_action(add)
+    self.version = commit.version
+
+  # Replay the commits after self.version, up to end_version (or the latest commit). Returns the commits that were applied.
+  def update(self, end_version=None):
+    applied = []
+    for commit in iter_commits(self.table_path, self.version + 1, end_version):
+      self.apply_commit(commit)
+      applied.append(commit)
+    return applied
+
+# COMMAND ----------
+
+# State of the table at `version` (the latest version when None).
+# with_stats=False skips decoding add.stats from the checkpoint, which is most of its size; use it when only paths and sizes are needed.
+def load_snapshot(table_path, version=None, with_stats=True):
+  snapshot = Snapshot(table_path)
+  checkpoint_version = find_checkpoint_version(table_path, version)
+  if checkpoint_version is not None:
+    columns = dict(SNAPSHOT_COLUMNS, add=SNAPSHOT_COLUMNS["add"] + ["stats"]) if with_stats else SNAPSHOT_COLUMNS
+    for action in read_checkpoint_actions(table_path, checkpoint_version, columns):
+      snapshot.apply_action(action)
+    snapshot.version = checkpoint_version
+  snapshot.update(version)
+  if snapshot.version < 0 or (version is not None and snapshot.version != version):
+    raise ValueError("Version %s of %s cannot be reconstructed from its _delta_log" % (version, table_path))
+  return snapshot
+
+# COMMAND ----------
+
+# Arrow type of the values of a Delta primitive type, as Spark writes them
+_DELTA_ARROW_TYPES = {
+  "byte": pa.int8(), "short": pa.int16(), "integer": pa.int32(), "long": pa.int64(),
+  "float": pa.float32(), "double": pa.float64(),
+  "string": pa.string(), "binary": pa.binary(), "boolean": pa.bool_(),
+  "date": pa.date32(), "timestamp": pa.timestamp("us", tz="UTC"), "timestamp_ntz": pa.timestamp("us"),
+}
+
+# Arrow type of a Delta schema type, or None for nested types, which are read as the file stores them
+def _arrow_type(delta_type):
+  if not isinstance(delta_type, str):
+    return None
+  decimal = re.fullmatch(r"decimal\((\d+),\s*(\d+)\)", delta_type)
+  if decimal:
+    return pa.decimal128(int(decimal.group(1)), int(decimal.group(2)))
+  return _DELTA_ARROW_TYPES.get(delta_type)
@@ -0,0 +1,208 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Table Stats
+# MAGIC
+# MAGIC Table-level numbers answered from the transaction log instead of from the data.
+# MAGIC
+# MAGIC Every `add` action carries `stats.numRecords`, so the row count of any version is the sum over the active files of that version.
+# MAGIC `spark.read.format("delta").option("versionAsOf", N).load(path).count()` opens every data file to get the same number.
+# MAGIC
+# MAGIC Usage:
+# MAGIC
+# MAGIC ```
+# MAGIC %run ./Includes/Delta-Table-Stats
+# MAGIC
+# MAGIC count_rows(delta_path, version=1)
+# MAGIC count_rows(delta_path)             # latest version
+# MAGIC
+# MAGIC display(timeline_to_pandas(table_timeline(delta_path)))   # rows, bytes and files for every version
+# MAGIC
+# MAGIC table_stats(delta_path)            # file count, total bytes and file-size histogram, from the .crc when there is one
+# MAGIC ```
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Snapshot
+
+# COMMAND ----------
+
+import bisect
+import builtins
+import json
+import os
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+# Row count of one data file from its Parquet footer; only used for files written without stats
+def _footer_num_rows(table_path, add):
+  return pq.ParquetFile(data_file_path(table_path, add.path)).metadata.num_rows
+
+# numRecords counts the rows a deletion vector hides, and table features (reader version 3) are what enable deletion vectors
+def _check_row_counts_exact(snapshot):
+  if snapshot.protocol is not None and snapshot.protocol.min_reader_version >= 3:
+    raise ValueError("%s uses table features such as deletion vectors; count its rows with Spark" % snapshot.table_path)
+
+# Number of rows in the table at `version` (latest when None), from add.stats.numRecords.
+# Files without stats fall back to reading their Parquet footer, so data pages are never read.
+def count_rows(table_path, version=None, snapshot=None):
+  if snapshot is None:
+    snapshot = load_snapshot(table_path, version)
+  _check_row_counts_exact(snapshot)
+  total = 0
+  for add in snapshot.files.values():
+    records = add.num_records
+    total += records if records is not None else _footer_num_rows(snapshot.table_path, add)
+  return total
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Timeline
+# MAGIC
+# MAGIC Rows, bytes and file count for every version, from one pass over the log. Each commit only adjusts the running totals
+# MAGIC by its own `add` and `remove` actions, so the whole history costs O(total actions) instead of one `versionAsOf` count per version.
+
+# COMMAND ----------
+
+@dataclass
+class TimelinePoint:
+  version: int
+  timestamp: Optional[int]
+  operation: Optional[str]
+  num_files: int
+  num_bytes: int
+  num_records: int
+  files_without_stats: int   # active files not included in num_records
+
+def _snapshot_point(snapshot, commit_timestamp=None):
+  records = [a.num_records for a in snapshot.files.values()]
+  return TimelinePoint(version=snapshot.version, timestamp=commit_timestamp, operation=None,
+                       num_files=snapshot.num_files, num_bytes=snapshot.size_in_bytes,
+                       num_records=builtins.sum(r for r in records if r is not None),
+                       files_without_stats=builtins.sum(1 for r in records if r is None))
+
+# One TimelinePoint per version in [start_version, end_version]. When the first versions have been cleaned up from the log,
+# the timeline starts at the oldest version that can still be reconstructed from a checkpoint.
+def table_timeline(table_path, start_version=0, end_version=None, max_workers=8, chunk_size=256):
+  versions = list_commit_versions(table_path, start_version, end_version)
+  if not versions:
+    return []
+  points = []
+  files = {}   # path -> (size, numRecords or None) for the active files
+  if versions[0] > 0:
+    snapshot = load_snapshot(table_path, versions[0])
+    files = {p: (a.size, a.num_records) for p, a in snapshot.files.items()}
+    points.append(_snapshot_point(snapshot, commit_timestamp(table_path, versions[0])))
+    versions = versions[1:]
+
+  totals = points[-1] if points else TimelinePoint(-1, None, None, 0, 0, 0, 0)
+  totals = [totals.num_files, totals.num_bytes, totals.num_records, totals.files_without_stats]
+
+  def account(entry, sign):
+    size, records = entry
+    totals[0] += sign
+    totals[1] += sign * size
+    if records is None:
+      totals[3] += sign
+    else:
+      totals[2] += sign * records
+
+  for chunk_start in range(0, len(versions), chunk_size):
+    chunk = versions[chunk_start:chunk_start + chunk_size]
+    for commit in read_commits(table_path, chunk[0], chunk[-1], max_workers=max_workers):
+      for remove in commit.removes:
+        entry = files.pop(remove.path, None)
+        if entry is not None:
+          account(entry, -1)
+      for add in commit.adds:
+        previous = files.get(add.path)
+        if previous is not None:
+          # Same path re-added (e.g. by RESTORE): replace the old entry
+          account(previous, -1)
+        files[add.path] = (add.size, add.num_records)
+        account(files[add.path], 1)
+      points.append(TimelinePoint(commit.version, commit.timestamp, commit.operation, *totals))
+  return points
+
+def timeline_to_pandas(timeline):
+  pdf = pd.DataFrame([asdict(p) for p in timeline])
+  if not pdf.empty:
+    pdf["timestamp"] = pd.to_datetime(pdf["timestamp"], unit="ms")
+  return pdf
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC ## Checksum (.crc) stats
+# MAGIC
+# MAGIC Next to each commit Delta may write `000...N.crc` holding the table totals at that version:
+# MAGIC `numFiles`, `tableSizeBytes` and `histogramOpt` (`sortedBinBoundaries`, `fileCounts`, `totalBytes`).
+# MAGIC `table_stats` reads that small JSON file directly. When the `.crc` is missing the same numbers are derived from the snapshot,
+# MAGIC using power-of-two bins from 8 KB to 4 GB.
+
+# COMMAND ----------
+
+DEFAULT_BIN_BOUNDARIES = [0] + [(8 * 1024) << i for i in range(20)]
+
+@dataclass
+class FileSizeHistogram:
+  sorted_bin_boundaries: List[int]   # start of each bin (inclusive); a bin ends where the next one starts
+  file_counts: List[int]
+  total_bytes: List[int]
+
+  @classmethod
+  def from_sizes(cls, sizes, boundaries=DEFAULT_BIN_BOUNDARIES):
+    histogram = cls(list(boundaries), [0] * len(boundaries), [0] * len(boundaries))
+    for size in sizes:
+      i = builtins.max(bisect.bisect_right(boundaries, size) - 1, 0)
+      histogram.file_counts[i] += 1
+      histogram.total_bytes[i] += size
+    return histogram
+
+  # Number of files strictly smaller than `size_bytes`, counting whole bins only
+  def files_below(self, size_bytes):
+    return builtins.sum(c for start, c, end in zip(self.sorted_bin_boundaries, self.file_counts, self.sorted_bin_boundaries[1:] + [None])
+               if end is not None and end <= size_bytes)
+
+@dataclass
+class TableStats:
+  version: int
+  num_files: int
+  total_bytes: int
+  histogram: FileSizeHistogram
+  source: str   # "crc" or "snapshot"
+
+def crc_file_path(table_path, version):
+  return os.path.join(delta_log_path(table_path), "%020d.crc" % version)
+
+# Parsed .crc of a version, or None when it was not written
+def read_crc(table_path, version):
+  try:
+    with open(crc_file_path(table_path, version), "r", encoding="utf-8") as f:
+      return json.loads(f.read())
+  except FileNotFoundError:
+    return None
+
+def _histogram_from_crc(crc):
+  histogram = crc.get("histogramOpt")
+  if not histogram:
+    return None
+  return FileSizeHistogram(sorted_bin_boundaries=histogram["sortedBinBoundaries"],
+                           file_counts=histogram["fileCounts"],
+                           total_bytes=histogram["totalBytes"])
+
+# File count, total bytes and file-size histogram of the table at `version` (latest when None)
+def table_stats(table_path, version=None):
+  if version is None:
+    version = latest_version(table_path)
+  crc = read_crc(table_path, version)
+  if crc is not None and "numFiles" in crc and "tableSizeBytes" in crc:
+    histogram = _histogram_from_crc(crc)
+    if histogram is not None:
+      return TableStats(version, crc["numFiles"], crc["tableSizeBytes"], histogram, "crc")
+  snapshot = load_snapshot(table_path, version, with_stats=False)
+  sizes = [a.size for a in snapshot.files.values()]
+  return TableStats(version, len(sizes), builtins.sum(sizes), FileSizeHistogram.from_sizes(sizes), "snapshot")
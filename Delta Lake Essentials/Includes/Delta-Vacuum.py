@@ -0,0 +1,183 @@
+# Databricks notebook source
+# MAGIC %md
+# MAGIC # Delta Vacuum
+# MAGIC
+# MAGIC `VACUUM` lists every file under the table directory recursively, diffs the listing against the snapshot and then deletes the files one by one.
+# MAGIC The snapshot already knows almost all of those files: every `remove` action that is still in the log or in the checkpoint is a tombstone
+# MAGIC with the path, the size and the time the file was removed. `vacuum_table`
+# MAGIC
+# MAGIC 1. takes its candidates from the tombstones older than the retention period, so a dry run costs one log replay and no listing;
+# MAGIC 2. lists the table directory only when `include_orphans=True`, to find files that no log entry refers to
+# MAGIC    (files of failed writes, and files whose tombstone expired from the checkpoints before they were vacuumed);
+# MAGIC 3. deletes through a bounded thread pool, optionally rate limited to stay below the storage's request limits,
+# MAGIC    and reports the bytes reclaimed.
+# MAGIC
+# MAGIC Usage:
+# MAGIC
+# MAGIC ```
+# MAGIC %run ./Includes/Delta-Vacuum
+# MAGIC
+# MAGIC report = vacuum_table(delta_path)                     # dry run with the table's retention
+# MAGIC print(report.summary())
+# MAGIC vacuum_table(delta_path, dry_run=False, max_workers=16, max_deletes_per_second=500)
+# MAGIC ```
+
+# COMMAND ----------
+
+# MAGIC %run ./Delta-Snapshot
+
+# COMMAND ----------
+
+import builtins
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+DEFAULT_DELETED_FILE_RETENTION_HOURS = 7 * 24
+
+_INTERVAL_UNIT_HOURS = {"millisecond": 1 / 3600000, "second": 1 / 3600, "minute": 1 / 60, "hour": 1, "day": 24, "week": 7 * 24}
+
+# Hours in a table property interval such as "interval 7 days" or "interval 1 week"
+def _interval_hours(interval):
+  match = re.fullmatch(r"\s*(?:interval\s+)?(\d+)\s+(millisecond|second|minute|hour|day|week)s?\s*", interval, re.IGNORECASE)
+  if match is None:
+    raise ValueError("Cannot parse interval %r" % interval)
+  return int(match.group(1)) * _INTERVAL_UNIT_HOURS[match.group(2).lower()]
+
+# delta.deletedFileRetentionDuration of the table, in hours
+def deleted_file_retention_hours(snapshot):
+  interval = snapshot.metadata.configuration.get("delta.deletedFileRetentionDuration") if snapshot.metadata else None
+  return _interval_hours(interval) if interval else DEFAULT_DELETED_FILE_RETENTION_HOURS
+
+@dataclass
+class VacuumCandidate:
+  path: str              # local path of the file
+  size: Optional[int]    # from remove.size or the listing; None when the tombstone has no size
+  source: str            # "tombstone" or "orphan"
+
+@dataclass
+class VacuumReport:
+  table_path: str
+  version: int
+  retention_hours: float
+  dry_run: bool
+  candidates: List[VacuumCandidate] = field(default_factory=list)
+  files_deleted: int = 0
+  bytes_reclaimed: int = 0
+  files_missing: int = 0      # already gone, e.g. removed by an earlier vacuum
+  failures: List[str] = field(default_factory=list)
+  seconds: float = 0.0
+
+  @property
+  def candidate_bytes(self):
+    return builtins.sum(c.size or 0 for c in self.candidates)
+
+  def summary(self):
+    tombstones = builtins.sum(1 for c in self.candidates if c.source == "tombstone")
+    if self.dry_run:
+      return ("Version %d (dry run): %d files to delete (%d tombstones, %d orphans), %d bytes"
+              % (self.version, len(self.candidates), tombstones, len(self.candidates) - tombstones, self.candidate_bytes))
+    return ("Version %d: deleted %d files, reclaimed %d bytes in %.1f s (%d already gone, %d failed)"
+            % (self.version, self.files_deleted, self.bytes_reclaimed, self.seconds, self.files_missing, len(self.failures)))
+
+# Shared by the delete threads: lets at most `rate` calls per second through
+class _RateLimiter:
+  def __init__(self, rate):
+    self.interval = 1.0 / rate if rate else 0.0
+    self.next_slot = time.monotonic()
+    self.lock = threading.Lock()
+
+  def acquire(self):
+    if not self.interval:
+      return
+    with self.lock:
+      now = time.monotonic()
+      wait = self.next_slot - now
+      self.next_slot = builtins.max(self.next_slot, now) + self.interval
+    if wait > 0:
+      time.sleep(wait)
+
+# COMMAND ----------
+
+# Tombstones removed before `cutoff` (epoch millis) whose path is not active again. Like VACUUM, only files under the table
+# directory are deleted: an absolute path elsewhere (e.g. a file a shallow clone refers to) belongs to another table.
+def _tombstone_candidates(snapshot, cutoff):
+  root = os.path.join(os.path.normpath(to_local_path(snapshot.table_path)), "")
+  candidates = []
+  for path, remove in snapshot.tombstones.items():
+    if path in snapshot.files or (remove.deletion_timestamp or 0) >= cutoff:
+      continue
+    local_path = data_file_path(snapshot.table_path, path)
+    if os.path.normpath(local_path).startswith(root):
+      candidates.append(VacuumCandidate(local_path, remove.size, "tombstone"))
+  return candidates
+
+# Files under the table directory that neither the active files nor the tombstones refer to, last modified before `cutoff`.
+# Like VACUUM, hidden files and directories (starting with "_" or ".") are skipped, except partition directories.
+def _orphan_candidates(snapshot, cutoff):
+  root = to_local_path(snapshot.table_path)
+  known = {data_file_path(snapshot.table_path, p) for p in snapshot.files}
+  known.update(data_file_path(snapshot.table_path, p) for p in snapshot.tombstones)
+  candidates = []
+  for directory, subdirs, names in os.walk(root):
+    subdirs[:] = [d for d in subdirs if not d.startswith(("_", ".")) or "=" in d]
+    for name in names:
+      if name.startswith(("_", ".")):
+        continue
+      path = os.path.join(directory, name)
+      if path in known:
+        continue
+      stat = os.stat(path)
+      if stat.st_mtime * 1000 < cutoff:
+        candidates.append(VacuumCandidate(path, stat.st_size, "orphan"))
+  return candidates
+
+def _delete_file(candidate, limiter):
+  limiter.acquire()
+  size = candidate.size
+  if size is None:
+    size = os.path.getsize(candidate.path)
+  os.remove(candidate.path)
+  return size
+
+# Delete the files no version within the retention period needs. Dry run by default.
+# retention_hours defaults to the table's delta.deletedFileRetentionDuration. Shorter retentions are refused unless
+# retention_check=False, the equivalent of spark.databricks.delta.retentionDurationCheck.enabled = false.
+def vacuum_table(table_path, retention_hours=None, dry_run=True, include_orphans=False, max_workers=8,
+                 max_deletes_per_second=None, retention_check=True, snapshot=None):
+  start = time.monotonic()
+  if snapshot is None:
+    snapshot = load_snapshot(table_path, with_stats=False)
+  table_retention = deleted_file_retention_hours(snapshot)
+  if retention_hours is None:
+    retention_hours = table_retention
+  elif retention_check and retention_hours < table_retention:
+    raise ValueError("Retention of %s hours is shorter than delta.deletedFileRetentionDuration (%s hours); "
+                     "pass retention_check=False to vacuum anyway" % (retention_hours, table_retention))
+  cutoff = int((time.time() - retention_hours * 3600) * 1000)
+
+  report = VacuumReport(table_path, snapshot.version, retention_hours, dry_run)
+  report.candidates = _tombstone_candidates(snapshot, cutoff)
+  if include_orphans:
+    report.candidates += _orphan_candidates(snapshot, cutoff)
+  if dry_run:
+    report.seconds = time.monotonic() - start
+    return report
+
+  limiter = _RateLimiter(max_deletes_per_second)
+  with ThreadPoolExecutor(max_workers=max_workers) as pool:
+    futures = [(c, pool.submit(_delete_file, c, limiter)) for c in report.candidates]
+    for candidate, future in futures:
+      try:
+        report.bytes_reclaimed += future.result()
+        report.files_deleted += 1
+      except FileNotFoundError:
+        report.files_missing += 1
+      except OSError as e:
+        report.failures.append("%s: %s" % (candidate.path, e))
+  report.seconds = time.monotonic() - start
+  return report